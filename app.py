@@ -1,22 +1,30 @@
 """
 Railway 要求每个 Python 项目有一个可启动的入口。
-本文件提供一个最小的占位进程，方便部署和查看日志。
+本文件是常驻 worker：进程内托管定时任务，复用同一进程里的数据库/HTTP 连接池，
+不再为每次任务冷启动解释器。
 
-你的真实业务逻辑依然通过：
-- `python -m scraper.jobs run_hourly`
-- `python -m scraper.jobs compute_daily`
-由 Railway 的定时任务（Cron）来调用。
+托管的任务（见 scraper.jobs.scheduled_jobs）：
+- 每小时抓取一次（等价于 `python -m scraper.jobs run_hourly`）
+- 每天 23:15 结算（等价于 `python -m scraper.jobs compute_daily`）
+
+设置 SCHEDULER_ENABLED=0 可退回到原来的空闲占位模式，继续由 Railway Cron 调用上述命令。
 """
 
 import logging
+import os
+import signal
 import time
 
+from scraper.config import settings
+from scraper.jobs import scheduled_jobs
+from scraper.scheduler import Scheduler
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def main() -> None:
+def idle() -> None:
     logger.info("Makuake scraper worker is running (idle). Waiting for cron jobs...")
     # 保持进程存活，方便 Railway 认为服务是“running”
     try:
@@ -26,6 +34,25 @@ def main() -> None:
         logger.info("Shutting down.")
 
 
+def main() -> None:
+    if os.environ.get("SCHEDULER_ENABLED", "1") == "0":
+        idle()
+        return
+
+    scheduler = Scheduler(
+        scheduled_jobs(),
+        misfire_grace=settings.scheduler_misfire_grace,
+        state_file=settings.scheduler_state_file or None,
+    )
+    # Railway 重启/下线时发送 SIGTERM：等当前任务跑完再退出
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    logger.info("Makuake scraper worker is running with in-process scheduler.")
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    logger.info("Shutting down.")
+
+
 if __name__ == "__main__":
     main()
-
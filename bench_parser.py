@@ -0,0 +1,79 @@
+"""
+对比 parse_metrics 快速路径（正则）与完整路径（lxml DOM + XPath）的单页耗时和内存。
+
+用法：
+    python bench_parser.py                  # 使用内置的 hero widget 样例
+    python bench_parser.py page1.html ...   # 使用归档下来的真实页面
+    python bench_parser.py -n 2000 page.html
+
+注意：tracemalloc 只统计 Python 层的分配，lxml/libxml2 在 C 层分配的 DOM 内存不在其中，
+因此完整路径的真实内存占用会比报告的峰值更高。
+"""
+import argparse
+import time
+import tracemalloc
+from pathlib import Path
+
+from scraper.parser import parse_metrics_fast, parse_metrics_full
+
+
+SAMPLE_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>hero</title></head>
+<body><section>
+  <div class="head"><h1>iFLYTEK AIWATCH</h1></div>
+  <div class="body">
+    <div class="img">{filler}</div>
+    <div class="name"><p>project</p></div>
+    <div class="stats">
+      <div><dl><dt>集まっている金額</dt><dd>170,006,897<span>円</span></dd></dl></div>
+      <div><dl><dt>目標金額</dt><dd>1,000,000円</dd></dl></div>
+      <div><div><dl><dt><span>サポーター</span></dt><dd>4,830<span>人</span></dd></dl></div></div>
+    </div>
+  </div>
+</section></body></html>
+""".format(filler="<p>" + "あいうえお " * 400 + "</p>")
+
+
+def bench(label: str, func, pages: list[str], iterations: int) -> None:
+    # 预热一次，顺便确认能解析
+    for page in pages:
+        func(page)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for page in pages:
+            func(page)
+    elapsed = time.perf_counter() - start
+    per_page_us = elapsed / (iterations * len(pages)) * 1e6
+
+    tracemalloc.start()
+    for page in pages:
+        func(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<6} {per_page_us:10.1f} us/page   peak(py) {peak / 1024:8.1f} KiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark parse_metrics fast vs full path")
+    parser.add_argument("files", nargs="*", help="HTML files to parse (default: built-in sample)")
+    parser.add_argument("-n", "--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    pages = [Path(f).read_text(encoding="utf-8") for f in args.files] or [SAMPLE_HTML]
+
+    fast_results = [parse_metrics_fast(page) for page in pages]
+    full_results = [parse_metrics_full(page) for page in pages]
+    misses = sum(1 for result in fast_results if result is None)
+    mismatches = sum(
+        1 for fast, full in zip(fast_results, full_results) if fast is not None and fast != full
+    )
+    print(f"pages={len(pages)} iterations={args.iterations} fast-path misses={misses} mismatches={mismatches}")
+
+    bench("fast", parse_metrics_fast, pages, args.iterations)
+    bench("full", parse_metrics_full, pages, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
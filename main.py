@@ -1,14 +1,138 @@
 import os
 import json
+import queue
+import threading
+import time
+from contextlib import asynccontextmanager
+
 import requests
+import requests.adapters
 from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from scraper.cli import get_report_text
-
-app = FastAPI()
+from scraper.config import settings
+from scraper.db import get_pool_stats
+from scraper.dedup import create_dedup_store
+from scraper.metrics import stage_metrics, timed
+from scraper.profiling import profiled
 
 # 🔴 从环境变量获取飞书配置
 APP_ID = os.environ.get("FEISHU_APP_ID")
 APP_SECRET = os.environ.get("FEISHU_APP_SECRET")
+# 后台回复线程数与排队上限：队列满时新请求直接丢弃，避免无限堆积
+REPLY_WORKERS = int(os.environ.get("REPLY_WORKERS", "2"))
+REPLY_QUEUE_SIZE = int(os.environ.get("REPLY_QUEUE_SIZE", "50"))
+
+
+class ReplyDispatcher:
+    """
+    把生成战报、回复飞书这类阻塞操作放到后台线程执行，webhook 只负责入队后立即返回。
+    统计排队深度、排队等待时间和执行耗时，通过 /stats 查看。
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "run_seconds_total": 0.0,
+            "run_seconds_max": 0.0,
+        }
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"reply-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10.0):
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, func, *args) -> bool:
+        try:
+            self._queue.put_nowait((time.monotonic(), func, args))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        with self._lock:
+            self._stats["submitted"] += 1
+        return True
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            enqueued_at, func, args = item
+            started = time.monotonic()
+            ok = True
+            try:
+                func(*args)
+            except Exception as e:
+                ok = False
+                print(f"❌ Background task {getattr(func, '__name__', func)} failed: {e}")
+            finished = time.monotonic()
+            with self._lock:
+                stats = self._stats
+                stats["completed" if ok else "failed"] += 1
+                stats["wait_seconds_total"] += started - enqueued_at
+                stats["wait_seconds_max"] = max(stats["wait_seconds_max"], started - enqueued_at)
+                stats["run_seconds_total"] += finished - started
+                stats["run_seconds_max"] = max(stats["run_seconds_max"], finished - started)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_capacity"] = self._queue.maxsize
+        stats["workers"] = len(self._threads)
+        return stats
+
+
+dispatcher = ReplyDispatcher(workers=REPLY_WORKERS, max_queue=REPLY_QUEUE_SIZE)
+# 飞书在我们响应慢时会重推同一事件，按 event_id / message_id 去重
+dedup_store = create_dedup_store()
+
+
+async def _call_dedup(method, key):
+    # postgres 模式会访问数据库，放到线程池里执行，避免阻塞事件循环
+    if settings.dedup_backend == "postgres":
+        return await run_in_threadpool(method, key)
+    return method(key)
+
+
+def _event_key(payload, event):
+    message_id = event.get("message", {}).get("message_id")
+    if message_id:
+        return f"msg:{message_id}"
+    event_id = payload.get("header", {}).get("event_id")
+    if event_id:
+        return f"evt:{event_id}"
+    return None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    dispatcher.start()
+    yield
+    dispatcher.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # ✅ 关键新增：根路径心跳接口 (解决 Railway 502 报错的核心)
 # Railway 会定期访问这个接口来确认服务是否存活
@@ -19,30 +143,161 @@ async def root():
         "message": "Makuake Bot is running correctly!"
     }
 
+FEISHU_API_BASE = "https://open.feishu.cn/open-apis"
+FEISHU_TIMEOUT = float(os.environ.get("FEISHU_TIMEOUT", "10"))
+# 飞书返回的 token 失效错误码：遇到后强制刷新 token 并重试一次
+FEISHU_INVALID_TOKEN_CODES = {99991661, 99991663, 99991668}
+
+
+def _create_feishu_session():
+    # 所有飞书请求共用一个 keep-alive 会话，省掉每次调用的 TCP+TLS 握手
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(REPLY_WORKERS, 2))
+    session.mount("https://", adapter)
+    return session
+
+
+feishu_session = _create_feishu_session()
+
+
+class TenantTokenManager:
+    """
+    缓存 tenant_access_token（有效期约 2 小时）：
+    - 距离过期不足 refresh_margin 秒时提前刷新，只让一个线程去刷新，其余线程继续用旧 token
+    - 已过期或还没有 token 时，并发请求在锁上排队，只会发起一次刷新
+    """
+
+    def __init__(self, session, refresh_margin=300):
+        self.session = session
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+
+    def _refresh(self):
+        url = f"{FEISHU_API_BASE}/auth/v3/tenant_access_token/internal"
+        resp = self.session.post(url, json={"app_id": APP_ID, "app_secret": APP_SECRET}, timeout=FEISHU_TIMEOUT)
+        data = resp.json()
+        token = data.get("tenant_access_token")
+        if not token:
+            raise RuntimeError(f"Feishu token request failed: code={data.get('code')} msg={data.get('msg')}")
+        self._token = token
+        self._expires_at = time.monotonic() + int(data.get("expire", 7200))
+
+    def get_token(self):
+        token, expires_at = self._token, self._expires_at
+        now = time.monotonic()
+        if token and now < expires_at - self.refresh_margin:
+            return token
+
+        if token and now < expires_at:
+            # 快过期但仍可用：抢到锁的线程负责刷新，其余线程不等待
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                except Exception as e:
+                    print(f"⚠️ 提前刷新飞书 Token 失败，继续使用旧 Token: {e}")
+                finally:
+                    self._lock.release()
+            return self._token
+
+        with self._lock:
+            if self._token and time.monotonic() < self._expires_at - self.refresh_margin:
+                return self._token
+            self._refresh()
+            return self._token
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+
+
+token_manager = TenantTokenManager(feishu_session)
+
+
 def get_tenant_access_token():
-    """获取飞书 API 调用凭证"""
-    url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
-    # 如果没有配置环境变量，这里可能会报错，建议加个判断或者 try-except，但目前保持简单
-    resp = requests.post(url, json={"app_id": APP_ID, "app_secret": APP_SECRET})
-    return resp.json().get("tenant_access_token")
+    """获取飞书 API 调用凭证（带缓存）"""
+    # 如果没有配置环境变量，这里会拿不到 token，由调用方打印提示
+    try:
+        return token_manager.get_token()
+    except Exception as e:
+        print(f"❌ 获取飞书 Token 失败: {e}")
+        return None
 
+@timed("reply")
 def reply_message(message_id, text):
     """回复消息给飞书"""
-    token = get_tenant_access_token()
-    if not token:
-        print("❌ 无法获取飞书 Token，请检查环境变量 FEISHU_APP_ID 和 SECRET")
-        return
-
-    url = f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/reply"
-    headers = {"Authorization": f"Bearer {token}"}
+    url = f"{FEISHU_API_BASE}/im/v1/messages/{message_id}/reply"
     payload = {
         "content": json.dumps({"text": text}),
         "msg_type": "text"
     }
-    resp = requests.post(url, headers=headers, json=payload)
+    for attempt in range(2):
+        token = get_tenant_access_token()
+        if not token:
+            print("❌ 无法获取飞书 Token，请检查环境变量 FEISHU_APP_ID 和 SECRET")
+            return
+
+        headers = {"Authorization": f"Bearer {token}"}
+        resp = feishu_session.post(url, headers=headers, json=payload, timeout=FEISHU_TIMEOUT)
+        try:
+            code = resp.json().get("code")
+        except ValueError:
+            code = None
+        if attempt == 0 and (resp.status_code == 401 or code in FEISHU_INVALID_TOKEN_CODES):
+            # 缓存的 token 被服务端判定失效（例如被重置），刷新后重试一次
+            token_manager.invalidate()
+            continue
+        break
     # 打印一下回复结果，方便在 Railway 日志里排查
     print(f"Reply sent: {resp.status_code}, {resp.text}")
 
+
+@profiled("webhook_report")
+def send_report(message_id):
+    """在后台线程中生成战报并回复（由 dispatcher 调用），按 PROFILE_RATE 采样性能数据"""
+    report = get_report_text(use_cache=True)
+    reply_message(message_id, report)
+
+
+@app.get("/stats")
+async def stats():
+    """后台回复队列的深度与耗时统计"""
+    return {"dispatcher": dispatcher.stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式：各阶段（抓取/解析/数据库/战报/回复）耗时直方图与错误数，外加队列和连接池的计数"""
+    reply = dispatcher.stats()
+    pool = get_pool_stats()
+    counters = {
+        "reply_dispatcher_submitted_total": reply["submitted"],
+        "reply_dispatcher_rejected_total": reply["rejected"],
+        "reply_dispatcher_completed_total": reply["completed"],
+        "reply_dispatcher_failed_total": reply["failed"],
+        "reply_dispatcher_wait_seconds_total": reply["wait_seconds_total"],
+        "reply_dispatcher_run_seconds_total": reply["run_seconds_total"],
+        "db_pool_acquires_total": pool.acquires,
+        "db_pool_acquire_errors_total": pool.acquire_errors,
+        "db_pool_health_checks_total": pool.health_checks,
+        "db_pool_reconnects_total": pool.reconnects,
+        "db_pool_acquire_seconds_total": pool.acquire_seconds_total,
+    }
+    gauges = {
+        "reply_dispatcher_queue_depth": reply["queue_depth"],
+        "reply_dispatcher_queue_capacity": reply["queue_capacity"],
+        "reply_dispatcher_workers": reply["workers"],
+        "reply_dispatcher_wait_seconds_max": reply["wait_seconds_max"],
+        "reply_dispatcher_run_seconds_max": reply["run_seconds_max"],
+        "db_pool_acquire_seconds_max": pool.acquire_seconds_max,
+    }
+    return PlainTextResponse(
+        stage_metrics.render_prometheus(gauges, counters),
+        media_type="text/plain; version=0.0.4",
+    )
+
 @app.post("/feishu/webhook")
 async def feishu_webhook(request: Request):
     """接收飞书事件的回调接口"""
@@ -58,6 +313,12 @@ async def feishu_webhook(request: Request):
     # 2. 处理正常消息事件
     # 飞书的结构: event -> message -> content
     event = payload.get("event", {})
+
+    # 重推的事件在做任何计算之前直接丢弃
+    event_key = _event_key(payload, event)
+    if event_key and await _call_dedup(dedup_store.seen, event_key):
+        print(f"Duplicate event ignored: {event_key}")
+        return {"status": "duplicate"}
     
     # 增加一点日志，方便在 Railway 看到收到了什么
     print(f"Received event: {json.dumps(event)}")
@@ -77,10 +338,12 @@ async def feishu_webhook(request: Request):
         
         # 3. 判断指令
         if "销量" in text or "战报" in text:
-            print("触发关键词，正在生成战报...")
-            # 运行爬虫逻辑
-            report = get_report_text()
-            # 回复消息
-            reply_message(message_id, report)
+            print("触发关键词，战报生成任务已加入后台队列...")
+            # 生成战报和回复都是阻塞操作，交给后台线程，这里立即给飞书回 200，避免超时重推
+            if not dispatcher.submit(send_report, message_id):
+                print("⚠️ 后台队列已满，丢弃本次请求")
+                # 没处理就撤销去重登记，飞书重推时还能再处理
+                await _call_dedup(dedup_store.forget, event_key)
+                return {"status": "busy"}
             
     return {"status": "ok"}
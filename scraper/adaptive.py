@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import urlsplit
+
+from .config import settings
+from .db import get_recent_activity
+from .logic import tz_local
+from .projects import load_projects
+from .targets import get_target_for_date
+
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_velocity(now: datetime, window: float | None = None) -> dict[str, float]:
+    """
+    根据最近 window 秒内的 raw_snapshots 估算每个项目的销售速度（支持者/秒）。
+    增量除以整个窗口的长度；项目在窗口开始之后才有第一条快照时，从那条快照算起。
+    窗口内没有新快照的项目（数值没变）不出现在结果里。
+    """
+    window = window or settings.adaptive_window
+    since = now - timedelta(seconds=window)
+    velocities: dict[str, float] = {}
+    for activity in get_recent_activity(since):
+        start = since if activity.baseline_at is not None else activity.first_at
+        span = (now - start).total_seconds()
+        if span > 0:
+            velocities[activity.project] = activity.quantity_delta / span
+    return velocities
+
+
+def budget_min_interval(budget: int | None = None) -> float:
+    """
+    按域名请求预算算出的最短间隔：每轮抓取会对同一域名发出（该域名下项目数）次请求。
+    """
+    budget = budget or settings.host_request_budget
+    per_host = Counter(urlsplit(project.url).netloc for project in load_projects())
+    busiest = max(per_host.values(), default=1)
+    return 3600.0 * busiest / budget
+
+
+class AdaptiveTrigger:
+    """
+    自适应抓取间隔：希望相邻两次抓取之间大约新增 adaptive_target_delta 个支持者。
+    速度取「最近实际速度」与「当日目标折算速度」中较大者，
+    因此大目标日（例如 targets.csv 里 2026-02-27 的 203 人）即使刚开场也会加密抓取；
+    结果限制在 [min_interval, max_interval] 内，并且不低于域名请求预算允许的最短间隔。
+    """
+
+    def __init__(
+        self,
+        min_interval: float | None = None,
+        max_interval: float | None = None,
+        target_delta: float | None = None,
+    ) -> None:
+        self.min_interval = min_interval or settings.adaptive_min_interval
+        self.max_interval = max_interval or settings.adaptive_max_interval
+        self.target_delta = target_delta or settings.adaptive_target_delta
+        self.last_interval: float | None = None
+
+    def _goal_velocity(self, now: datetime) -> float:
+        today = now.astimezone(tz_local).date()
+        velocity = 0.0
+        for project in load_projects():
+            target = get_target_for_date(today, project.slug)
+            if target and target.goal_daily_quantity > 0:
+                velocity = max(velocity, target.goal_daily_quantity / 86400.0)
+        return velocity
+
+    def interval(self, now: datetime) -> float:
+        try:
+            observed = max(estimate_velocity(now).values(), default=0.0)
+            velocity = max(observed, self._goal_velocity(now))
+        except Exception as exc:  # noqa: BLE001 - 估算失败时退回最长间隔
+            logger.warning("Velocity estimate failed, using max interval: %s", exc)
+            velocity = 0.0
+
+        if velocity > 0:
+            interval = self.target_delta / velocity
+        else:
+            interval = self.max_interval
+        floor = max(self.min_interval, budget_min_interval())
+        interval = min(max(interval, floor), max(self.max_interval, floor))
+        if self.last_interval is None or abs(interval - self.last_interval) >= 1:
+            logger.info("Adaptive poll interval: %.0fs (velocity %.5f/s)", interval, velocity)
+        self.last_interval = interval
+        return interval
+
+    def next_after(self, when: datetime) -> datetime:
+        return when + timedelta(seconds=self.interval(when))
+
+    def previous(self, when: datetime) -> Optional[datetime]:
+        # 间隔是动态的，没有固定的「上一次计划时间」，不做补跑
+        return None
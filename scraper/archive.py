@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# zstd 压缩率和速度都更好，但依赖可选的 zstandard 包；没装时用 gzip
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 取决于部署环境
+    zstandard = None
+
+CODEC_SUFFIX = {"zstd": ".zst", "gzip": ".gz"}
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archived blob is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def read_blob(path: str | Path, codec: str) -> str:
+    """直接按文件路径读取归档页面，不需要打开索引（供子进程使用）。"""
+    return _decompress(Path(path).read_bytes(), codec).decode("utf-8")
+
+
+@dataclass(frozen=True)
+class ArchivedPage:
+    project: str
+    fetched_at: datetime
+    url: str
+    sha256: str
+
+
+class HtmlArchive:
+    """
+    原始 HTML 归档：页面按内容 sha256 去重、压缩后存成 objects/ab/<sha256>.zst|.gz，
+    SQLite 索引（index.sqlite）记录每次抓取 (project, fetched_at) 对应哪个页面。
+    归档总大小超过 max_bytes 时，从最早的抓取记录开始删除，直到回到上限以内。
+    """
+
+    def __init__(self, root: str | Path, max_bytes: int = 0, codec: str | None = None) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.codec = codec or ("zstd" if zstandard is not None else "gzip")
+        if self.codec == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed, archiving with gzip instead")
+            self.codec = "gzip"
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                size INTEGER NOT NULL,      -- 压缩后字节数
+                raw_size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                project TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,   -- UTC ISO 8601，字典序即时间序
+                url TEXT NOT NULL,
+                sha256 TEXT NOT NULL REFERENCES blobs (sha256),
+                PRIMARY KEY (project, fetched_at)
+            );
+            CREATE INDEX IF NOT EXISTS pages_fetched_at_idx ON pages (fetched_at);
+            CREATE INDEX IF NOT EXISTS pages_sha256_idx ON pages (sha256);
+            """
+        )
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _blob_path(self, sha256: str, codec: str) -> Path:
+        return self.root / "objects" / sha256[:2] / (sha256 + CODEC_SUFFIX[codec])
+
+    @staticmethod
+    def _key(when: datetime) -> str:
+        return when.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def put(self, project: str, url: str, fetched_at: datetime, html: str) -> str:
+        """归档一次抓取，返回页面的 sha256。内容已存在时只新增索引记录。"""
+        raw = html.encode("utf-8")
+        sha256 = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            known = self._db.execute("SELECT 1 FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if known is None:
+                data = _compress(raw, self.codec)
+                path = self._blob_path(sha256, self.codec)
+                path.parent.mkdir(exist_ok=True)
+                tmp = path.with_suffix(path.suffix + ".tmp")
+                tmp.write_bytes(data)
+                os.replace(tmp, path)
+                self._db.execute(
+                    "INSERT INTO blobs (sha256, codec, size, raw_size) VALUES (?, ?, ?, ?)",
+                    (sha256, self.codec, len(data), len(raw)),
+                )
+                self._total_bytes += len(data)
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (project, fetched_at, url, sha256) VALUES (?, ?, ?, ?)",
+                (project, self._key(fetched_at), url, sha256),
+            )
+            self._db.commit()
+            if self.max_bytes and self._total_bytes > self.max_bytes:
+                self._enforce_retention()
+        return sha256
+
+    def link(self, project: str, url: str, fetched_at: datetime, sha256: str) -> None:
+        """记录一次内容未变化的抓取（例如 304），指向已归档的页面。"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (project, fetched_at, url, sha256) "
+                "SELECT ?, ?, ?, sha256 FROM blobs WHERE sha256 = ?",
+                (project, self._key(fetched_at), url, sha256),
+            )
+            self._db.commit()
+
+    def _enforce_retention(self) -> None:
+        """删除最早的抓取记录及不再被引用的页面，直到总大小不超过 max_bytes。调用方持有锁。"""
+        removed_pages = removed_blobs = 0
+        while self._total_bytes > self.max_bytes:
+            oldest = self._db.execute(
+                "SELECT project, fetched_at, sha256 FROM pages ORDER BY fetched_at LIMIT 1"
+            ).fetchone()
+            if oldest is None:
+                break
+            project, fetched_at, sha256 = oldest
+            self._db.execute("DELETE FROM pages WHERE project = ? AND fetched_at = ?", (project, fetched_at))
+            removed_pages += 1
+            if self._db.execute("SELECT 1 FROM pages WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone():
+                continue
+            codec, size = self._db.execute("SELECT codec, size FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            self._blob_path(sha256, codec).unlink(missing_ok=True)
+            self._total_bytes -= size
+            removed_blobs += 1
+        self._db.commit()
+        if removed_pages:
+            logger.info(
+                "Archive retention removed %d pages (%d blobs), %d bytes remain",
+                removed_pages,
+                removed_blobs,
+                self._total_bytes,
+            )
+
+    def locate(self, sha256: str) -> tuple[Path, str]:
+        """返回页面文件的 (路径, 压缩方式)。"""
+        with self._lock:
+            row = self._db.execute("SELECT codec FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            raise KeyError(sha256)
+        return self._blob_path(sha256, row[0]), row[0]
+
+    def read(self, sha256: str) -> str:
+        return read_blob(*self.locate(sha256))
+
+    def iter_pages(
+        self,
+        project: str | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> Iterator[ArchivedPage]:
+        """按 fetched_at 顺序列出 [start, end) 内的抓取记录。"""
+        sql = "SELECT project, fetched_at, url, sha256 FROM pages WHERE 1 = 1"
+        params: list = []
+        if project is not None:
+            sql += " AND project = ?"
+            params.append(project)
+        if start is not None:
+            sql += " AND fetched_at >= ?"
+            params.append(self._key(start))
+        if end is not None:
+            sql += " AND fetched_at < ?"
+            params.append(self._key(end))
+        sql += " ORDER BY fetched_at, project"
+        # 用独立的只读连接逐行读取，长时间遍历时不阻塞归档写入
+        reader = sqlite3.connect(f"file:{self.root / 'index.sqlite'}?mode=ro", uri=True)
+        try:
+            for project_slug, fetched_at, url, sha256 in reader.execute(sql, params):
+                yield ArchivedPage(project_slug, datetime.fromisoformat(fetched_at), url, sha256)
+        finally:
+            reader.close()
+
+
+_archive: Optional[HtmlArchive] = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> Optional[HtmlArchive]:
+    """未配置 ARCHIVE_DIR 时返回 None（不归档）。"""
+    global _archive
+    if not settings.archive_dir:
+        return None
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = HtmlArchive(
+                    settings.archive_dir,
+                    max_bytes=settings.archive_max_mb * 1024 * 1024,
+                    codec=settings.archive_codec or None,
+                )
+    return _archive
@@ -1,12 +1,35 @@
 from __future__ import annotations
 
 import argparse
+import csv
 import logging
 import sys
+from datetime import date, datetime, time, timedelta, timezone
 
-# 务必导入 finalize_today_metrics，因为它包含了读取 CSV 和计算 GAP 的逻辑
-from .db import create_tables
-from .logic import finalize_today_metrics, scrape_once
+# 战报只读计算（compute_today_metrics），daily_metrics 的写入交给 scraper.jobs
+from .config import settings
+from .db import (
+    DAILY_METRICS_FIELDS,
+    SNAPSHOT_COLUMNS,
+    SnapshotInput,
+    create_tables,
+    explain_snapshot_lookups,
+    get_latest_snapshot_version,
+    get_daily_rollup,
+    insert_snapshots,
+    iter_daily_metrics,
+    iter_snapshots_between,
+    rebuild_hourly_rollup,
+    refresh_hourly_rollup,
+)
+from .engine import scrape_all
+from .export import FORMATS, export_rows
+from .logic import compute_today_metrics, recompute_daily_range, scrape_once, tz_local
+from .metrics import timed
+from .projection import Projection, get_projection
+from .projects import get_project
+from .reparse import reparse_archive
+from .report_cache import report_cache
 
 
 logging.basicConfig(level=logging.INFO)
@@ -24,56 +47,171 @@ def format_wan(value: int | float | None) -> str:
     return f"{val_wan:.1f}万"
 
 
-def get_report_text() -> str:
+def render_report(metrics, projection: Projection | None = None) -> str:
+    """把 TodayMetrics（以及可选的按当前速度预测）渲染成战报文本。"""
+    # --- 格式化时间 ---
+    # 为了兼容性，统一使用 %m (02月) 而不是 %-m (2月)，防止在某些Linux环境报错
+    dt_str = metrics.now_at.strftime("%m月%d日 %H:%M")
+
+    lines = []
+    # 1. 标题与实际数据
+    lines.append(f"{dt_str} 战报")
+    lines.append(f"新增人数: {metrics.sales_quantity_today} 人")
+    lines.append(f"新增金额: {format_wan(metrics.sales_amount_today)}")
+    lines.append("") # 空行
+
+    # 2. 目标数据
+    lines.append(f"目标人数: {metrics.goal_daily_quantity} 人")
+    lines.append(f"目标金额: {format_wan(metrics.goal_daily_amount)}")
+    lines.append("")
+
+    # 3. 当日 GAP 与 进度
+    lines.append(f"人数GAP: {metrics.gap_daily_quantity} (进度 {metrics.pct_daily_quantity:.1f}%)")
+    lines.append(f"金额GAP: {format_wan(metrics.gap_daily_amount)} (进度 {metrics.pct_daily_amount:.1f}%)")
+    lines.append("-" * 20)
+
+    # 4. 累计 GAP 与 进度
+    lines.append(f"累计人数GAP: {metrics.gap_total_quantity}")
+    lines.append(f"累计金额GAP: {format_wan(metrics.gap_total_amount)}")
+
+    # 5. 按当前速度的预测
+    if projection is not None:
+        lines.append("-" * 20)
+        lines.append(f"当前速度: {projection.pace_quantity_per_hour:.1f} 人/小时")
+        day_line = (
+            f"预计今日: {projection.projected_day_quantity} 人 / {format_wan(projection.projected_day_amount)}"
+        )
+        if projection.goal_daily_quantity > 0:
+            short = projection.goal_daily_quantity - projection.projected_day_quantity
+            day_line += " (可达成)" if short <= 0 else f" (差 {short} 人)"
+        lines.append(day_line)
+        # 众筹已结束时外推时间为 0，「预计」就只是当前累计，不再显示
+        if projection.campaign_end is not None and projection.campaign_end >= projection.as_of.date():
+            total_line = (
+                f"预计{projection.campaign_end.strftime('%m月%d日')}结束时累计: "
+                f"{projection.projected_total_quantity} 人 / {format_wan(projection.projected_total_amount)}"
+            )
+            if projection.goal_total_quantity > 0:
+                short = projection.goal_total_quantity - projection.projected_total_quantity
+                total_line += " (可达成)" if short <= 0 else f" (差 {short} 人)"
+            lines.append(total_line)
+
+    return "\n".join(lines)
+
+
+def _compute_report_text() -> str:
+    metrics = compute_today_metrics()
+
+    if metrics is None:
+        return "【数据不足】无法计算。请确保数据库中至少有昨天的基准数据和今天的最新数据。\n提示：如果是第一次运行，请手动去数据库修改一条历史数据的时间为昨天。"
+
+    # 预测失败时只省略预测部分
+    try:
+        projection = get_projection()
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Projection failed: {e}")
+        projection = None
+    return render_report(metrics, projection)
+
+
+def get_report_text(use_cache: bool = False) -> str:
     """
     核心逻辑：获取今日数据并生成格式化的文本战报。
     该函数返回字符串，既可以用于 print，也可以用于发送飞书消息。
+    use_cache=True 时按 (项目, 本地日期, 最新快照的 id 与 last_seen_at) 缓存结果，并发的相同请求只计算一次。
     """
     try:
-        metrics = finalize_today_metrics()
-        
-        if metrics is None:
-            return "【数据不足】无法计算。请确保数据库中至少有昨天的基准数据和今天的最新数据。\n提示：如果是第一次运行，请手动去数据库修改一条历史数据的时间为昨天。"
-
-        # --- 格式化时间 ---
-        # 为了兼容性，统一使用 %m (02月) 而不是 %-m (2月)，防止在某些Linux环境报错
-        dt_str = metrics.now_at.strftime("%m月%d日 %H:%M")
-
-        lines = []
-        # 1. 标题与实际数据
-        lines.append(f"{dt_str} 战报")
-        lines.append(f"新增人数: {metrics.sales_quantity_today} 人")
-        lines.append(f"新增金额: {format_wan(metrics.sales_amount_today)}")
-        lines.append("") # 空行
-
-        # 2. 目标数据
-        lines.append(f"目标人数: {metrics.goal_daily_quantity} 人")
-        lines.append(f"目标金额: {format_wan(metrics.goal_daily_amount)}")
-        lines.append("")
-
-        # 3. 当日 GAP 与 进度
-        lines.append(f"人数GAP: {metrics.gap_daily_quantity} (进度 {metrics.pct_daily_quantity:.1f}%)")
-        lines.append(f"金额GAP: {format_wan(metrics.gap_daily_amount)} (进度 {metrics.pct_daily_amount:.1f}%)")
-        lines.append("-" * 20)
+        with timed("report"):
+            if not use_cache:
+                return _compute_report_text()
 
-        # 4. 累计 GAP 与 进度
-        lines.append(f"累计人数GAP: {metrics.gap_total_quantity}")
-        lines.append(f"累计金额GAP: {format_wan(metrics.gap_total_amount)}")
-        
-        return "\n".join(lines)
+            project = settings.default_project
+            local_date = datetime.now(timezone.utc).astimezone(tz_local).date()
+            key = (project, local_date, get_latest_snapshot_version(project))
+            return report_cache.get_or_compute(key, _compute_report_text)
 
     except Exception as e:
         logger.error(f"Generate report failed: {e}")
         return f"❌ 生成战报时出错: {str(e)}"
 
 
+def _read_snapshot_csv(path: str, default_project: str):
+    """逐行读取回填用的 CSV：scraped_at,total_amount,total_quantity[,project]。"""
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            scraped_at = datetime.fromisoformat(row["scraped_at"])
+            if scraped_at.tzinfo is None:
+                scraped_at = tz_local.localize(scraped_at)
+            yield SnapshotInput(
+                project=row.get("project") or default_project,
+                scraped_at=scraped_at,
+                total_amount=int(row["total_amount"]),
+                total_quantity=int(row["total_quantity"]),
+            )
+
+
+def _local_day_start(value: str) -> datetime:
+    """把 YYYY-MM-DD 解释为本地时区当天 00:00。"""
+    return tz_local.localize(datetime.combine(date.fromisoformat(value), time(0, 0)))
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Makuake scraper CLI")
     sub = parser.add_subparsers(dest="command")
 
     sub.add_parser("init-db", help="Create database tables")
-    sub.add_parser("scrape-once", help="Fetch page once and store snapshot")
-    sub.add_parser("today-metrics", help="Calculate and print today's metrics with targets")
+    scrape_once_parser = sub.add_parser("scrape-once", help="Fetch page once and store snapshot")
+    scrape_once_parser.add_argument("--project", help="Project slug (default: DEFAULT_PROJECT)")
+    sub.add_parser("scrape-all", help="Fetch all registered projects concurrently and store snapshots")
+    import_parser = sub.add_parser(
+        "import-snapshots", help="Bulk-load snapshots from a CSV file (backfill)"
+    )
+    import_parser.add_argument("path", help="CSV with scraped_at,total_amount,total_quantity[,project]")
+    import_parser.add_argument("--project", help="Project for rows without one (default: DEFAULT_PROJECT)")
+    import_parser.add_argument("--page-size", type=int, default=1000, help="Rows per INSERT statement")
+    reparse_parser = sub.add_parser(
+        "reparse", help="Re-parse archived HTML with the current parser and fix raw_snapshots"
+    )
+    reparse_parser.add_argument("--project", help="Only this project (default: all archived projects)")
+    reparse_parser.add_argument("--from", dest="date_from", help="First local date (YYYY-MM-DD)")
+    reparse_parser.add_argument("--to", dest="date_to", help="Last local date, inclusive (YYYY-MM-DD)")
+    reparse_parser.add_argument("--workers", type=int, help="Parser processes (default: CPU count)")
+    reparse_parser.add_argument("--batch-size", type=int, default=2000, help="Pages per database write")
+    reparse_parser.add_argument("--dry-run", action="store_true", help="Parse only, do not write")
+    recompute_parser = sub.add_parser(
+        "recompute-daily", help="Rebuild daily_metrics for a range of local dates in one query"
+    )
+    recompute_parser.add_argument("--from", dest="date_from", required=True, help="First local date (YYYY-MM-DD)")
+    recompute_parser.add_argument("--to", dest="date_to", help="Last local date, inclusive (default: today)")
+    recompute_parser.add_argument("--project", help="Project slug (default: DEFAULT_PROJECT)")
+    rollup_parser = sub.add_parser(
+        "rollup", help="Update the hourly rollup table and optionally print daily aggregates"
+    )
+    rollup_parser.add_argument("--rebuild", action="store_true", help="Rebuild the rollup from scratch")
+    rollup_parser.add_argument("--from", dest="date_from", help="Print daily aggregates from this local date")
+    rollup_parser.add_argument("--to", dest="date_to", help="Last local date to print (default: today)")
+    rollup_parser.add_argument("--project", help="Project slug (default: DEFAULT_PROJECT)")
+    export_parser = sub.add_parser(
+        "export", help="Stream raw snapshots or daily_metrics to CSV / NDJSON / Parquet"
+    )
+    export_parser.add_argument("table", choices=["snapshots", "daily-metrics"])
+    export_parser.add_argument("--from", dest="date_from", required=True, help="First local date (YYYY-MM-DD)")
+    export_parser.add_argument("--to", dest="date_to", help="Last local date, inclusive (default: today)")
+    export_parser.add_argument("--project", help="Project slug (default: DEFAULT_PROJECT)")
+    export_parser.add_argument("--all-projects", action="store_true", help="Export every project")
+    export_parser.add_argument("--format", choices=FORMATS, help="Output format (default: from file suffix, else csv)")
+    export_parser.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    sub.add_parser("today-metrics", help="Calculate and print today's metrics with targets (read-only)")
+    check_parser = sub.add_parser(
+        "check-indexes", help="EXPLAIN the snapshot lookups and verify they use index-only scans"
+    )
+    check_parser.add_argument("--project", help="Project slug (default: DEFAULT_PROJECT)")
+    check_parser.add_argument(
+        "--rows",
+        type=int,
+        default=0,
+        help="Run against a session-local synthetic table with this many rows instead of the real data",
+    )
 
     args = parser.parse_args()
 
@@ -83,7 +221,7 @@ def main() -> None:
 
     elif args.command == "scrape-once":
         try:
-            metrics = scrape_once()
+            metrics = scrape_once(get_project(args.project))
             print(
                 f"Scraped successfully:\n"
                 f"Total Amount: {metrics.total_amount}\n"
@@ -93,10 +231,114 @@ def main() -> None:
             logger.error(f"Scrape failed: {e}")
             sys.exit(1)
 
+    elif args.command == "scrape-all":
+        results = scrape_all()
+        for result in results:
+            if result.ok:
+                print(
+                    f"[{result.project.slug}] Total Amount: {result.metrics.total_amount}, "
+                    f"Total Quantity: {result.metrics.total_quantity} ({result.elapsed:.2f}s)"
+                )
+            else:
+                print(f"[{result.project.slug}] FAILED: {result.error}")
+        if not any(result.ok for result in results):
+            sys.exit(1)
+
+    elif args.command == "import-snapshots":
+        rows = _read_snapshot_csv(args.path, args.project or settings.default_project)
+        stats, inserted = insert_snapshots(rows, page_size=args.page_size, returning=True)
+        print(f"Imported {stats.rows} snapshots in {stats.seconds:.2f}s ({stats.rows_per_sec:.0f} rows/s)")
+        if inserted:
+            # 补录的多是历史数据，小时汇总的增量刷新不会回看那么远，按导入的时间范围重算
+            times = [scraped_at for _, _, scraped_at in inserted]
+            rebuild_hourly_rollup(min(times), max(times) + timedelta(hours=1))
+
+    elif args.command == "reparse":
+        stats = reparse_archive(
+            project=args.project,
+            start=_local_day_start(args.date_from) if args.date_from else None,
+            end=_local_day_start(args.date_to) + timedelta(days=1) if args.date_to else None,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+        )
+        print(
+            f"Reparsed {stats.pages} pages ({stats.parsed} distinct, {stats.failed} failed) "
+            f"in {stats.seconds:.2f}s ({stats.pages_per_sec:.0f} pages/s): "
+            f"{stats.updated} updated, {stats.inserted} inserted"
+        )
+        if stats.failed:
+            sys.exit(1)
+
+    elif args.command == "recompute-daily":
+        start = date.fromisoformat(args.date_from)
+        end = date.fromisoformat(args.date_to) if args.date_to else datetime.now(tz_local).date()
+        written = set(recompute_daily_range(start, end, args.project))
+        total = (end - start).days + 1
+        print(f"Recomputed {len(written)}/{total} days from {start} to {end}.")
+        missing = [start + timedelta(days=i) for i in range(total) if start + timedelta(days=i) not in written]
+        if missing:
+            print("Skipped (no snapshots at the day boundaries): " + ", ".join(d.isoformat() for d in missing))
+
+    elif args.command == "rollup":
+        stats = rebuild_hourly_rollup() if args.rebuild else refresh_hourly_rollup()
+        print(
+            f"Rolled up {stats.rows} snapshots into {stats.buckets} hourly buckets "
+            f"in {stats.seconds:.2f}s (covered until {stats.covered_until.isoformat() if stats.covered_until else '-'})."
+        )
+        if args.date_from:
+            end = date.fromisoformat(args.date_to) if args.date_to else datetime.now(tz_local).date()
+            for day in get_daily_rollup(date.fromisoformat(args.date_from), end, args.project):
+                print(
+                    f"{day.period}  人数 {day.first_quantity} -> {day.last_quantity}  "
+                    f"金额 {format_wan(day.first_amount)} -> {format_wan(day.last_amount)}  ({day.samples} 条快照)"
+                )
+
+    elif args.command == "export":
+        start = date.fromisoformat(args.date_from)
+        end = date.fromisoformat(args.date_to) if args.date_to else datetime.now(tz_local).date()
+        if args.table == "snapshots":
+            snapshots = iter_snapshots_between(
+                _local_day_start(start.isoformat()),
+                _local_day_start(end.isoformat()) + timedelta(days=1),
+                project=args.project,
+                all_projects=args.all_projects,
+            )
+            columns = SNAPSHOT_COLUMNS
+            rows = ((s.id, s.project, s.scraped_at, s.total_amount, s.total_quantity, s.last_seen_at) for s in snapshots)
+        else:
+            columns = DAILY_METRICS_FIELDS
+            rows = iter_daily_metrics(start, end, project=args.project, all_projects=args.all_projects)
+        try:
+            stats = export_rows(rows, columns, args.output, args.format)
+        except (RuntimeError, ValueError) as e:
+            logger.error(f"Export failed: {e}")
+            sys.exit(1)
+        # 统计信息写到 stderr，避免混进导出到 stdout 的数据
+        size = f", {stats.bytes / 1024 / 1024:.1f} MB" if stats.bytes else ""
+        print(
+            f"Exported {stats.rows} rows in {stats.seconds:.2f}s ({stats.rows_per_sec:.0f} rows/s{size}).",
+            file=sys.stderr,
+        )
+
     elif args.command == "today-metrics":
         # 直接调用封装好的函数并打印
         print(get_report_text())
 
+    elif args.command == "check-indexes":
+        checks = explain_snapshot_lookups(project=args.project, synthetic_rows=args.rows)
+        for check in checks:
+            status = "OK" if check.ok else "FAIL"
+            print(
+                f"[{status}] {check.name}: {check.execution_ms:.3f} ms, "
+                f"heap fetches={check.heap_fetches}"
+            )
+            print(check.plan_text)
+        if not all(check.ok for check in checks):
+            if not args.rows:
+                print("提示：表很小时 Postgres 会直接全表扫描，可加 --rows 1000000 用模拟数据验证。")
+            sys.exit(1)
+
     else:
         parser.print_help()
 
@@ -1,51 +1,239 @@
 from __future__ import annotations
 
 import contextlib
+import logging
+import threading
+import time
+import uuid
 from dataclasses import dataclass
-from datetime import datetime, timezone
-from typing import Iterable, Optional
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Iterable, Iterator, NamedTuple, Optional
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
 from .config import settings
+from .metrics import timed
+
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
 class SnapshotRow:
     id: int
+    project: str
     scraped_at: datetime  # UTC
     total_amount: int
     total_quantity: int
+    # 去重写入模式下，数值未变化的后续观测只会延长这个时间，不再新增行
+    last_seen_at: Optional[datetime] = None
+
+    @property
+    def observed_at(self) -> datetime:
+        """最后一次确认该数值的时间。"""
+        return self.last_seen_at or self.scraped_at
+
+
+@dataclass
+class PoolStats:
+    acquires: int = 0  # 成功借出连接的次数
+    acquire_errors: int = 0  # 借出失败（连不上、池满等）的次数
+    health_checks: int = 0
+    reconnects: int = 0  # 因连接失效而丢弃重建的次数
+    acquire_seconds_total: float = 0.0  # 借出连接累计耗时（含健康检查/重连）
+    acquire_seconds_max: float = 0.0
+
+    @property
+    def acquire_ms_avg(self) -> float:
+        return self.acquire_seconds_total / self.acquires * 1000 if self.acquires else 0.0
+
+
+_pool: Optional[ThreadedConnectionPool] = None
+# ThreadedConnectionPool 在连接耗尽时直接抛错，这里用信号量让调用方排队等待
+_pool_slots: Optional[threading.BoundedSemaphore] = None
+_pool_lock = threading.Lock()
+_stats = PoolStats()
+_stats_lock = threading.Lock()
+# id(conn) -> 最近一次归还的时间，用于判断是否需要健康检查
+_last_used: dict[int, float] = {}
+
+# 这两类异常说明连接本身坏了（网络断开、服务端重启等），归还时应直接丢弃
+_BROKEN_CONN_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+def _connect_kwargs() -> dict:
+    return {
+        "connect_timeout": settings.db_connect_timeout,
+        # Railway 公网代理会回收长时间空闲的连接，开启 TCP keepalive 尽早发现断链
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 3,
+    }
 
 
 def get_conn():
+    """
+    新建一个独立连接（不经过连接池），调用方负责关闭。
+    仅供一次性脚本使用，业务代码请使用 pooled_conn()。
+    """
     if not settings.database_url:
         raise RuntimeError("DATABASE_URL is not set.")
-    return psycopg2.connect(settings.database_url)
+    return psycopg2.connect(settings.database_url, **_connect_kwargs())
+
+
+def _get_pool() -> ThreadedConnectionPool:
+    global _pool, _pool_slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if not settings.database_url:
+                    raise RuntimeError("DATABASE_URL is not set.")
+                _pool = ThreadedConnectionPool(
+                    settings.db_pool_min,
+                    settings.db_pool_max,
+                    settings.database_url,
+                    **_connect_kwargs(),
+                )
+                _pool_slots = threading.BoundedSemaphore(settings.db_pool_max)
+    return _pool
+
+
+def close_pool() -> None:
+    """关闭进程级连接池（进程退出或测试时调用）。"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+
+
+def get_pool_stats() -> PoolStats:
+    """返回连接池计数器的快照。"""
+    with _stats_lock:
+        return PoolStats(**vars(_stats))
+
+
+def _is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is not None and time.monotonic() - last_used < settings.db_health_check_interval:
+        return True
+    with _stats_lock:
+        _stats.health_checks += 1
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except _BROKEN_CONN_ERRORS:
+        return False
+
+
+def _acquire(pool: ThreadedConnectionPool):
+    start = time.perf_counter()
+    try:
+        conn = pool.getconn()
+        # 池里的连接可能已被服务端或代理断开：丢弃后重连一次
+        if not _is_healthy(conn):
+            logger.warning("Discarding broken pooled DB connection, reconnecting.")
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            with _stats_lock:
+                _stats.reconnects += 1
+            conn = pool.getconn()
+            if not _is_healthy(conn):
+                pool.putconn(conn, close=True)
+                raise psycopg2.OperationalError("Pooled DB connection is unhealthy after reconnect.")
+    except (PoolError, *_BROKEN_CONN_ERRORS):
+        with _stats_lock:
+            _stats.acquire_errors += 1
+        raise
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _stats.acquires += 1
+        _stats.acquire_seconds_total += elapsed
+        _stats.acquire_seconds_max = max(_stats.acquire_seconds_max, elapsed)
+    return conn
+
+
+@contextlib.contextmanager
+def pooled_conn(autocommit: bool = False) -> Iterator:
+    """
+    从进程级连接池借出一个连接，with 块正常结束时提交，异常时回滚，最后归还到池中。
+    连接若在使用中断开，归还时会被直接丢弃，下次借出时自动重建。
+    autocommit=True 用于不能放在事务里执行的语句（CREATE INDEX CONCURRENTLY、VACUUM 等）。
+    """
+    pool = _get_pool()
+    slots = _pool_slots
+    if not slots.acquire(timeout=settings.db_pool_timeout):
+        with _stats_lock:
+            _stats.acquire_errors += 1
+        raise PoolError(f"Timed out after {settings.db_pool_timeout}s waiting for a DB connection.")
+    try:
+        conn = _acquire(pool)
+        broken = False
+        try:
+            if autocommit:
+                # psycopg2 >= 2.9 的 `with conn` 即使在 autocommit 下也会开启事务，这里直接交出连接
+                conn.autocommit = True
+                yield conn
+            else:
+                with conn:
+                    yield conn
+        except _BROKEN_CONN_ERRORS:
+            broken = True
+            raise
+        finally:
+            broken = broken or bool(conn.closed)
+            if autocommit and not broken:
+                conn.autocommit = False
+            if broken:
+                _last_used.pop(id(conn), None)
+            else:
+                _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=broken)
+    finally:
+        slots.release()
 
 
 def create_tables():
-    with get_conn() as conn:
+    with pooled_conn() as conn:
         with conn.cursor() as cur:
             # 1. 创建原始快照表
             cur.execute(
                 """
                 CREATE TABLE IF NOT EXISTS raw_snapshots (
                     id SERIAL PRIMARY KEY,
+                    project TEXT NOT NULL,
                     scraped_at TIMESTAMPTZ NOT NULL,
                     total_amount BIGINT NOT NULL,
                     total_quantity INTEGER NOT NULL,
+                    last_seen_at TIMESTAMPTZ,
                     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
                 );
                 """
             )
+            # 老部署的表没有 project 列：补上，历史数据归到默认项目
+            cur.execute(
+                "ALTER TABLE raw_snapshots ADD COLUMN IF NOT EXISTS project TEXT NOT NULL DEFAULT %s;",
+                (settings.default_project,),
+            )
+            cur.execute("ALTER TABLE raw_snapshots ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMPTZ;")
+            # 页内留出空间，延长 last_seen_at 的 UPDATE 才能在同一页内完成（HOT）；只影响之后写入的页
+            cur.execute("ALTER TABLE raw_snapshots SET (fillfactor = 90);")
             
             # 2. 创建每日统计表 (包含所有新字段)
             cur.execute(
                 """
                 CREATE TABLE IF NOT EXISTS daily_metrics (
-                    date DATE PRIMARY KEY,
+                    project TEXT NOT NULL,
+                    date DATE NOT NULL,
                     
                     -- 实际数据
                     baseline_amount BIGINT NOT NULL,
@@ -65,71 +253,883 @@ def create_tables():
                     diff_total_amount BIGINT DEFAULT 0,
                     diff_total_quantity INTEGER DEFAULT 0,
                     
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (project, date)
+                );
+                """
+            )
+            # 老部署的表只按 date 做主键：补上 project 列（历史数据归到默认项目），主键改为 (project, date)
+            cur.execute(
+                "ALTER TABLE daily_metrics ADD COLUMN IF NOT EXISTS project TEXT NOT NULL DEFAULT %s;",
+                (settings.default_project,),
+            )
+            cur.execute(
+                """
+                DO $$
+                DECLARE pk_name TEXT;
+                BEGIN
+                    SELECT conname INTO pk_name
+                    FROM pg_constraint
+                    WHERE conrelid = 'daily_metrics'::regclass AND contype = 'p' AND array_length(conkey, 1) = 1;
+                    IF pk_name IS NOT NULL THEN
+                        EXECUTE format('ALTER TABLE daily_metrics DROP CONSTRAINT %I', pk_name);
+                        ALTER TABLE daily_metrics ADD PRIMARY KEY (project, date);
+                    END IF;
+                END $$;
+                """
+            )
+
+            # 3. 飞书事件去重表（多副本部署时共享）
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS processed_events (
+                    event_key TEXT PRIMARY KEY,
+                    processed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+
+            # 4. 每小时汇总（由 refresh_hourly_rollup 按时间水位增量维护）
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS snapshot_hourly (
+                    project TEXT NOT NULL,
+                    hour TIMESTAMPTZ NOT NULL,
+                    first_at TIMESTAMPTZ NOT NULL,
+                    first_amount BIGINT NOT NULL,
+                    first_quantity INTEGER NOT NULL,
+                    last_at TIMESTAMPTZ NOT NULL,
+                    last_amount BIGINT NOT NULL,
+                    last_quantity INTEGER NOT NULL,
+                    max_amount BIGINT NOT NULL,
+                    max_quantity INTEGER NOT NULL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (project, hour)
+                );
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rollup_watermarks (
+                    name TEXT PRIMARY KEY,
+                    covered_until TIMESTAMPTZ,
                     updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
                 );
                 """
             )
+            # 老部署的水位是 raw_snapshots.id（last_id 列，已不再使用）：补上时间水位，首次刷新时从头构建
+            cur.execute("ALTER TABLE rollup_watermarks ADD COLUMN IF NOT EXISTS covered_until TIMESTAMPTZ;")
+
+    create_indexes()
+
+
+# raw_snapshots 的索引：
+# - (project, scraped_at) B-tree，INCLUDE 只读不改的数值列，只取数值的查找（如 LATERAL 探测）可以走 Index Only Scan
+# - scraped_at 上的 BRIN：数据按时间追加写入，跨项目的时间范围扫描用它，体积只有几十 KB
+# 去重写入每次抓取都会 UPDATE last_seen_at，所以它不放进任何索引，否则这些更新无法走 HOT，
+# 每次都要往所有索引插入新条目。代价是要读 last_seen_at 的查询需要回表（按项目取最近几行，回表行数很少）。
+RAW_SNAPSHOTS_INDEXES = {
+    "raw_snapshots_project_time_incl_idx": (
+        "ON raw_snapshots (project, scraped_at) INCLUDE (id, total_amount, total_quantity)"
+    ),
+    "raw_snapshots_scraped_at_brin": "ON raw_snapshots USING brin (scraped_at)",
+}
+# 被上面的索引取代、需要在线删除的旧索引
+OBSOLETE_INDEXES = ["raw_snapshots_project_scraped_at_idx", "raw_snapshots_project_time_idx"]
+
+
+def create_indexes() -> None:
+    """
+    在线创建 raw_snapshots 的索引（CREATE INDEX CONCURRENTLY，不阻塞写入）。
+    之前中断的并发建索引会留下 INVALID 索引，这里会先删掉再重建。
+    """
+    with pooled_conn(autocommit=True) as conn, conn.cursor() as cur:
+        for name, definition in RAW_SNAPSHOTS_INDEXES.items():
+            cur.execute(
+                """
+                SELECT i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s AND pg_table_is_visible(c.oid);
+                """,
+                (name,),
+            )
+            row = cur.fetchone()
+            if row is not None and row[0]:
+                continue
+            if row is not None:
+                logger.warning("Index %s is invalid, rebuilding.", name)
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+            logger.info("Creating index %s ...", name)
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition};")
+        for name in OBSOLETE_INDEXES:
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
 
-def insert_snapshot(total_amount: int, total_quantity: int, scraped_at: Optional[datetime] = None) -> None:
+def _row_to_snapshot(row) -> SnapshotRow:
+    return SnapshotRow(
+        id=row["id"],
+        project=row["project"],
+        scraped_at=row["scraped_at"],
+        total_amount=row["total_amount"],
+        total_quantity=row["total_quantity"],
+        last_seen_at=row.get("last_seen_at"),
+    )
+
+
+@timed("db.insert_snapshot")
+def insert_snapshot(
+    total_amount: int,
+    total_quantity: int,
+    scraped_at: Optional[datetime] = None,
+    project: Optional[str] = None,
+) -> int:
+    """写入一条快照，返回新行的 id。"""
     if scraped_at is None:
         scraped_at = datetime.now(timezone.utc)
 
-    with contextlib.closing(get_conn()) as conn, conn, conn.cursor() as cur:
+    with pooled_conn() as conn, conn.cursor() as cur:
         cur.execute(
             """
-            INSERT INTO raw_snapshots (scraped_at, total_amount, total_quantity)
-            VALUES (%s, %s, %s);
+            INSERT INTO raw_snapshots (project, scraped_at, total_amount, total_quantity)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id;
+            """,
+            (project or settings.default_project, scraped_at, total_amount, total_quantity),
+        )
+        return cur.fetchone()[0]
+
+
+class SnapshotInput(NamedTuple):
+    project: str
+    scraped_at: datetime
+    total_amount: int
+    total_quantity: int
+
+
+@dataclass
+class BulkStats:
+    rows: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[list]:
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@timed("db.insert_snapshots")
+def insert_snapshots(
+    rows: Iterable[SnapshotInput],
+    page_size: int = 1000,
+    returning: bool = False,
+) -> tuple[BulkStats, list[tuple[int, str, datetime]]]:
+    """
+    批量写入快照：按 page_size 分批用 execute_values 拼成多行 INSERT，整批在一个事务里。
+    rows 可以是生成器，内存占用与 page_size 成正比。
+    returning=True 时返回新行的 (id, project, scraped_at)。
+    """
+    stats = BulkStats()
+    inserted: list[tuple[int, str, datetime]] = []
+    start = time.perf_counter()
+    with pooled_conn() as conn, conn.cursor() as cur:
+        for chunk in _chunks(rows, page_size):
+            result = execute_values(
+                cur,
+                """
+                INSERT INTO raw_snapshots (project, scraped_at, total_amount, total_quantity)
+                VALUES %s
+                """
+                + (" RETURNING id, project, scraped_at" if returning else ""),
+                chunk,
+                page_size=page_size,
+                fetch=returning,
+            )
+            if returning:
+                inserted.extend(result)
+            stats.rows += len(chunk)
+    stats.seconds = time.perf_counter() - start
+    if stats.rows:
+        logger.info(
+            "Inserted %d snapshots in %.3fs (%.0f rows/s)", stats.rows, stats.seconds, stats.rows_per_sec
+        )
+    return stats, inserted
+
+
+@dataclass
+class UpsertStats(BulkStats):
+    updated: int = 0
+    inserted: int = 0
+
+
+_UPSERT_SNAPSHOTS_SQL = """
+    WITH v (project, scraped_at, total_amount, total_quantity) AS (
+        VALUES %s
+    ),
+    updated AS (
+        UPDATE raw_snapshots AS r
+        SET total_amount = v.total_amount, total_quantity = v.total_quantity
+        FROM v
+        WHERE r.project = v.project AND r.scraped_at = v.scraped_at
+          AND (r.total_amount, r.total_quantity) IS DISTINCT FROM (v.total_amount, v.total_quantity)
+        RETURNING r.id
+    ),
+    inserted AS (
+        INSERT INTO raw_snapshots (project, scraped_at, total_amount, total_quantity)
+        SELECT v.project, v.scraped_at, v.total_amount, v.total_quantity
+        FROM v
+        -- 同一时间点已有快照（由上面的 UPDATE 负责修正）时不插入
+        WHERE NOT EXISTS (
+            SELECT 1 FROM raw_snapshots AS r
+            WHERE r.project = v.project AND r.scraped_at = v.scraped_at
+        )
+        -- 被前一行的 last_seen_at 区间覆盖且数值相同（去重写入时延长过的行）时也不插入
+        AND NOT EXISTS (
+            SELECT 1
+            FROM (
+                SELECT r.last_seen_at, r.total_amount, r.total_quantity
+                FROM raw_snapshots AS r
+                WHERE r.project = v.project AND r.scraped_at < v.scraped_at
+                ORDER BY r.scraped_at DESC
+                LIMIT 1
+            ) AS prev
+            WHERE prev.last_seen_at >= v.scraped_at
+              AND prev.total_amount = v.total_amount AND prev.total_quantity = v.total_quantity
+        )
+        RETURNING id
+    )
+    SELECT (SELECT count(*) FROM updated), (SELECT count(*) FROM inserted);
+"""
+
+
+@timed("db.upsert_snapshots")
+def upsert_snapshots(rows: Iterable[SnapshotInput], page_size: int = 1000) -> UpsertStats:
+    """
+    按 (project, scraped_at) 幂等地写入快照：已存在的时间点改写数值，不存在的新增。
+    每个 page_size 批次是一条语句（UPDATE 与 INSERT 写在同一个 CTE 里），
+    重复执行同一批数据不会产生新行。用于从归档重新解析历史页面。
+    """
+    stats = UpsertStats()
+    start = time.perf_counter()
+    with pooled_conn() as conn, conn.cursor() as cur:
+        for chunk in _chunks(rows, page_size):
+            # 同一批次内的重复时间点以最后一条为准，否则 INSERT 会插入两次
+            unique = list({(row.project, row.scraped_at): row for row in chunk}.values())
+            execute_values(
+                cur,
+                _UPSERT_SNAPSHOTS_SQL,
+                unique,
+                template="(%s, %s::timestamptz, %s::bigint, %s::integer)",
+                page_size=len(unique),
+            )
+            updated, inserted = cur.fetchone()
+            stats.rows += len(unique)
+            stats.updated += updated
+            stats.inserted += inserted
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+@timed("db.extend_snapshots")
+def extend_snapshots(extensions: Iterable[tuple[int, datetime]]) -> set[int]:
+    """
+    数值没变时延长已有快照的 last_seen_at，而不是新增一行。extensions 为 (snapshot_id, seen_at)。
+    只有仍是该项目最新一行的快照才会被延长（别的进程可能已经写入了更新的快照），
+    返回实际被延长的 id，其余的调用方应改为插入新行。
+    """
+    extensions = list(extensions)
+    if not extensions:
+        return set()
+    with pooled_conn() as conn, conn.cursor() as cur:
+        rows = execute_values(
+            cur,
+            """
+            UPDATE raw_snapshots AS r
+            SET last_seen_at = v.seen_at
+            FROM (VALUES %s) AS v(id, seen_at)
+            WHERE r.id = v.id
+              AND r.scraped_at < v.seen_at
+              AND NOT EXISTS (
+                  SELECT 1 FROM raw_snapshots AS n
+                  WHERE n.project = r.project AND n.scraped_at > r.scraped_at
+              )
+            RETURNING r.id
             """,
-            (scraped_at, total_amount, total_quantity),
+            extensions,
+            template="(%s, %s::timestamptz)",
+            fetch=True,
         )
+    return {row[0] for row in rows}
+
+
+_SNAPSHOTS_BETWEEN_SQL = """
+    SELECT id, project, scraped_at, total_amount, total_quantity, last_seen_at
+    FROM raw_snapshots
+    WHERE project = %s AND scraped_at >= %s AND scraped_at < %s
+    ORDER BY scraped_at ASC;
+"""
+
+_LAST_SNAPSHOT_BEFORE_SQL = """
+    SELECT id, project, scraped_at, total_amount, total_quantity, last_seen_at
+    FROM raw_snapshots
+    WHERE project = %s AND scraped_at <= %s
+    ORDER BY scraped_at DESC
+    LIMIT 1;
+"""
+
+
+@timed("db.get_snapshots_between")
+def get_snapshots_between(start: datetime, end: datetime, project: Optional[str] = None) -> list[SnapshotRow]:
+    with pooled_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(_SNAPSHOTS_BETWEEN_SQL, (project or settings.default_project, start, end))
+        rows = cur.fetchall()
+    return [_row_to_snapshot(row) for row in rows]
+
+
+def iter_query(sql: str, params, itersize: int) -> Iterator[tuple]:
+    """
+    用服务端（命名）游标逐批读取查询结果，每次只取 itersize 行到客户端，内存占用与结果总行数无关。
+    迭代期间会一直占用一个连接池连接，调用方应尽快消费完或关闭生成器。
+    """
+    with pooled_conn() as conn, conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+        cur.itersize = itersize
+        cur.execute(sql, params)
+        yield from cur
+
+
+SNAPSHOT_COLUMNS = ("id", "project", "scraped_at", "total_amount", "total_quantity", "last_seen_at")
+
+
+def iter_snapshots_between(
+    start: datetime,
+    end: datetime,
+    project: Optional[str] = None,
+    all_projects: bool = False,
+    itersize: int = 5000,
+) -> Iterator[SnapshotRow]:
+    """
+    get_snapshots_between 的流式版本：按 (project, scraped_at) 顺序逐行产出 SnapshotRow。
+    all_projects=True 时忽略 project，返回所有项目。
+    """
+    sql = f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM raw_snapshots WHERE scraped_at >= %s AND scraped_at < %s"
+    params: list = [start, end]
+    if not all_projects:
+        sql += " AND project = %s"
+        params.append(project or settings.default_project)
+    sql += " ORDER BY project, scraped_at;"
+    for row in iter_query(sql, params, itersize):
+        yield SnapshotRow(*row)
+
 
+DAILY_METRICS_FIELDS = (
+    "project",
+    "date",
+    "baseline_amount", "baseline_quantity",
+    "end_amount", "end_quantity",
+    "sales_amount_today", "sales_quantity_today",
+    "goal_daily_amount", "goal_daily_quantity",
+    "goal_total_amount", "goal_total_quantity",
+    "diff_daily_amount", "diff_daily_quantity",
+    "diff_total_amount", "diff_total_quantity",
+    "updated_at",
+)
 
-def get_snapshots_between(start: datetime, end: datetime) -> list[SnapshotRow]:
-    with contextlib.closing(get_conn()) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+
+def iter_daily_metrics(
+    start,
+    end,
+    project: Optional[str] = None,
+    all_projects: bool = False,
+    itersize: int = 5000,
+) -> Iterator[tuple]:
+    """
+    按 (project, date) 顺序流式读取 [start, end]（闭区间）的 daily_metrics，列顺序见 DAILY_METRICS_FIELDS。
+    all_projects=True 时忽略 project，返回所有项目。
+    """
+    sql = f"SELECT {', '.join(DAILY_METRICS_FIELDS)} FROM daily_metrics WHERE date >= %s AND date <= %s"
+    params: list = [start, end]
+    if not all_projects:
+        sql += " AND project = %s"
+        params.append(project or settings.default_project)
+    sql += " ORDER BY project, date;"
+    return iter_query(sql, params, itersize)
+
+
+@timed("db.get_last_snapshot_before")
+def get_last_snapshot_before(when: datetime, project: Optional[str] = None) -> Optional[SnapshotRow]:
+    with pooled_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(_LAST_SNAPSHOT_BEFORE_SQL, (project or settings.default_project, when))
+        row = cur.fetchone()
+    if not row:
+        return None
+    return _row_to_snapshot(row)
+
+
+@timed("db.claim_event")
+def claim_event(event_key: str) -> bool:
+    """
+    尝试登记一个飞书事件。首次登记返回 True；已被（任一副本）处理过返回 False。
+    """
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO processed_events (event_key) VALUES (%s) ON CONFLICT (event_key) DO NOTHING;",
+            (event_key,),
+        )
+        return cur.rowcount == 1
+
+
+@timed("db.release_event")
+def release_event(event_key: str) -> None:
+    """撤销登记（事件未能处理时调用，让飞书重推的事件可以再次被处理）。"""
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM processed_events WHERE event_key = %s;", (event_key,))
+
+
+@timed("db.prune_events")
+def prune_events(older_than: datetime) -> int:
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM processed_events WHERE processed_at < %s;", (older_than,))
+        return cur.rowcount
+
+
+@dataclass
+class ProjectActivity:
+    project: str
+    baseline_at: Optional[datetime]  # since 时仍然有效的那条快照的 scraped_at；项目在 since 之后才有数据时为 None
+    first_at: datetime  # 窗口内第一条快照的 scraped_at
+    last_at: datetime
+    quantity_delta: int  # 最新值 - since 时的值（没有基准时为 - 窗口内第一条的值）
+    amount_delta: int
+
+
+@timed("db.get_recent_activity")
+def get_recent_activity(since: datetime) -> list[ProjectActivity]:
+    """
+    since 之后有新快照的项目，自 since 以来的增量（一次查询，窗口内走 scraped_at 的 BRIN 索引）。
+    去重写入时数值不变不产生新行，窗口开始时的数值来自 since 之前的最后一行，
+    因此每个项目用 LATERAL 取这一行作为基准；只看窗口内的行会丢掉从它到第一条新行的那一步。
+    """
+    with pooled_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute(
             """
-            SELECT id, scraped_at, total_amount, total_quantity
-            FROM raw_snapshots
-            WHERE scraped_at >= %s AND scraped_at < %s
-            ORDER BY scraped_at ASC;
+            WITH recent AS (
+                SELECT project,
+                       MIN(scraped_at) AS first_at,
+                       MAX(COALESCE(last_seen_at, scraped_at)) AS last_at,
+                       (ARRAY_AGG(total_quantity ORDER BY scraped_at))[1] AS first_quantity,
+                       (ARRAY_AGG(total_amount ORDER BY scraped_at))[1] AS first_amount,
+                       (ARRAY_AGG(total_quantity ORDER BY scraped_at DESC))[1] AS last_quantity,
+                       (ARRAY_AGG(total_amount ORDER BY scraped_at DESC))[1] AS last_amount
+                FROM raw_snapshots
+                WHERE scraped_at >= %(since)s
+                GROUP BY project
+            )
+            SELECT r.project,
+                   b.scraped_at AS baseline_at,
+                   r.first_at,
+                   r.last_at,
+                   r.last_quantity - COALESCE(b.total_quantity, r.first_quantity) AS quantity_delta,
+                   r.last_amount - COALESCE(b.total_amount, r.first_amount) AS amount_delta
+            FROM recent r
+            LEFT JOIN LATERAL (
+                SELECT scraped_at, total_quantity, total_amount
+                FROM raw_snapshots
+                WHERE project = r.project AND scraped_at < %(since)s
+                ORDER BY scraped_at DESC
+                LIMIT 1
+            ) AS b ON TRUE;
             """,
-            (start, end),
+            {"since": since},
         )
         rows = cur.fetchall()
-    return [
-        SnapshotRow(
-            id=row["id"],
-            scraped_at=row["scraped_at"],
-            total_amount=row["total_amount"],
-            total_quantity=row["total_quantity"],
-        )
-        for row in rows
-    ]
+    return [ProjectActivity(**row) for row in rows]
 
 
-def get_last_snapshot_before(when: datetime) -> Optional[SnapshotRow]:
-    with contextlib.closing(get_conn()) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+@timed("db.get_latest_snapshot_version")
+def get_latest_snapshot_version(project: Optional[str] = None) -> Optional[tuple[int, Optional[datetime]]]:
+    """
+    最新一条快照的 (id, last_seen_at)，用作缓存键（走 (project, scraped_at) 索引，开销很小）。
+    去重写入会原地延长 last_seen_at 而不新增行，所以只看 id 不够。
+    """
+    with pooled_conn() as conn, conn.cursor() as cur:
         cur.execute(
             """
-            SELECT id, scraped_at, total_amount, total_quantity
-            FROM raw_snapshots
-            WHERE scraped_at <= %s
+            SELECT id, last_seen_at FROM raw_snapshots
+            WHERE project = %s
             ORDER BY scraped_at DESC
             LIMIT 1;
             """,
-            (when,),
+            (project or settings.default_project,),
         )
         row = cur.fetchone()
-    if not row:
-        return None
-    return SnapshotRow(
-        id=row["id"],
-        scraped_at=row["scraped_at"],
-        total_amount=row["total_amount"],
-        total_quantity=row["total_quantity"],
+    return (row[0], row[1]) if row else None
+
+
+@timed("db.get_latest_snapshots")
+def get_latest_snapshots(projects: Iterable[str]) -> dict[str, SnapshotRow]:
+    """一次查询取多个项目各自的最新快照（每个项目一次 LATERAL 索引探测）。"""
+    with pooled_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            SELECT s.*
+            FROM unnest(%s::text[]) AS p(project)
+            CROSS JOIN LATERAL (
+                SELECT id, project, scraped_at, total_amount, total_quantity, last_seen_at
+                FROM raw_snapshots
+                WHERE raw_snapshots.project = p.project
+                ORDER BY scraped_at DESC
+                LIMIT 1
+            ) AS s;
+            """,
+            (list(projects),),
+        )
+        return {row["project"]: _row_to_snapshot(row) for row in cur.fetchall()}
+
+
+@timed("db.get_snapshots_asof")
+def get_snapshots_asof(lookups: Iterable[tuple[str, datetime]]) -> list[Optional[SnapshotRow]]:
+    """
+    按 (project, 时刻) 批量取「该时刻之前（含）最后一条快照」，结果与输入一一对应，没有则为 None。
+    每个时刻一次 LATERAL 索引探测，所有时刻只需一次往返。
+    """
+    lookups = list(lookups)
+    if not lookups:
+        return []
+    with pooled_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            SELECT s.*
+            FROM unnest(%s::text[], %s::timestamptz[]) WITH ORDINALITY AS q(project, at, i)
+            LEFT JOIN LATERAL (
+                SELECT id, project, scraped_at, total_amount, total_quantity, last_seen_at
+                FROM raw_snapshots
+                WHERE raw_snapshots.project = q.project AND scraped_at <= q.at
+                ORDER BY scraped_at DESC
+                LIMIT 1
+            ) AS s ON TRUE
+            ORDER BY q.i;
+            """,
+            ([project for project, _ in lookups], [at for _, at in lookups]),
+        )
+        return [_row_to_snapshot(row) if row["id"] is not None else None for row in cur.fetchall()]
+
+
+@dataclass
+class SnapshotRollup:
+    project: str
+    period: object  # 小时汇总为 UTC 整点 datetime，按日汇总为本地日期
+    first_at: datetime
+    first_amount: int
+    first_quantity: int
+    last_at: datetime
+    last_amount: int
+    last_quantity: int
+    max_amount: int
+    max_quantity: int
+    samples: int  # 覆盖该时段的快照行数（extend 模式下一行可以覆盖多个小时）
+
+
+@dataclass
+class RollupStats:
+    rows: int = 0  # 本次涉及的快照行数
+    buckets: int = 0  # 重算的 (project, hour) 数
+    covered_until: Optional[datetime] = None  # 水位：此时刻之前写入的快照都已并入汇总
+    seconds: float = 0.0
+
+
+HOURLY_ROLLUP = "snapshot_hourly"
+
+# 找出 [since, until) 内被快照覆盖的 (project, hour)。
+# 去重写入（SNAPSHOT_DEDUP=extend）时一行快照代表 [scraped_at, last_seen_at] 这段时间的数值，
+# 数值不变只会延长 last_seen_at、不产生新行，所以要按覆盖区间而不是 scraped_at 来找小时。
+# 各行的覆盖区间首尾相接、互不重叠，since 之前开始的行里只有每个项目的最后一行可能延伸到 since 之后。
+# 小时从 hours_from 与行的 scraped_at 中较晚者开始：增量刷新时传 -infinity，这样抓取中断数小时后以相同数值恢复、
+# 一次把 last_seen_at 延长很多的行，中间的小时也会被补上。
+_ROLLUP_SPAN_HOURS = """
+    projects AS (
+        -- 沿 (project, scraped_at) 索引逐个跳到下一个项目，不必扫描全表
+        (SELECT project FROM raw_snapshots ORDER BY project LIMIT 1)
+        UNION ALL
+        SELECT (SELECT r.project FROM raw_snapshots r WHERE r.project > p.project ORDER BY r.project LIMIT 1)
+        FROM projects p
+        WHERE p.project IS NOT NULL
+    ),
+    spans AS (
+        SELECT project, scraped_at, COALESCE(last_seen_at, scraped_at) AS observed_at
+        FROM raw_snapshots
+        WHERE scraped_at >= %(since)s::timestamptz AND scraped_at < %(until)s::timestamptz
+          AND (%(project)s::text IS NULL OR project = %(project)s)
+        UNION ALL
+        SELECT p.project, s.scraped_at, s.observed_at
+        FROM projects p
+        CROSS JOIN LATERAL (
+            SELECT r.scraped_at, COALESCE(r.last_seen_at, r.scraped_at) AS observed_at
+            FROM raw_snapshots r
+            WHERE r.project = p.project AND r.scraped_at < %(since)s::timestamptz
+            ORDER BY r.scraped_at DESC
+            LIMIT 1
+        ) AS s
+        WHERE p.project IS NOT NULL
+          AND (%(project)s::text IS NULL OR p.project = %(project)s)
+          AND s.observed_at >= %(since)s::timestamptz
+    ),
+    span_hours AS (
+        SELECT spans.project, hour
+        FROM spans
+        CROSS JOIN LATERAL generate_series(
+            date_trunc('hour', GREATEST(spans.scraped_at, %(hours_from)s::timestamptz) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+            spans.observed_at,
+            INTERVAL '1 hour'
+        ) AS hour
+        WHERE hour < %(until)s::timestamptz
+    ),
+"""
+
+# 重算 touched(project, hour) 中每个小时桶并 upsert。桶里的快照 = 该小时内开始的行 + 之前开始、延伸进该小时的一行；
+# first_at / last_at 为这些行的覆盖区间在该小时内的起止，samples 为覆盖该小时的快照行数。
+# 总是从 raw_snapshots 完整重算整个桶（一个桶只有几行），所以重复处理同一个小时结果不变
+_HOURLY_ROLLUP_UPSERT = """
+    agg AS (
+        SELECT
+            t.project,
+            t.hour,
+            MIN(GREATEST(r.scraped_at, t.hour)) AS first_at,
+            (ARRAY_AGG(r.total_amount ORDER BY r.scraped_at))[1] AS first_amount,
+            (ARRAY_AGG(r.total_quantity ORDER BY r.scraped_at))[1] AS first_quantity,
+            MAX(LEAST(COALESCE(r.last_seen_at, r.scraped_at), t.hour + INTERVAL '1 hour')) AS last_at,
+            (ARRAY_AGG(r.total_amount ORDER BY r.scraped_at DESC))[1] AS last_amount,
+            (ARRAY_AGG(r.total_quantity ORDER BY r.scraped_at DESC))[1] AS last_quantity,
+            MAX(r.total_amount) AS max_amount,
+            MAX(r.total_quantity) AS max_quantity,
+            COUNT(*) AS samples
+        FROM touched t
+        CROSS JOIN LATERAL (
+            SELECT scraped_at, last_seen_at, total_amount, total_quantity
+            FROM raw_snapshots
+            WHERE project = t.project
+              AND scraped_at >= t.hour
+              AND scraped_at < t.hour + INTERVAL '1 hour'
+            UNION ALL
+            (
+                SELECT scraped_at, last_seen_at, total_amount, total_quantity
+                FROM raw_snapshots
+                WHERE project = t.project AND scraped_at < t.hour
+                ORDER BY scraped_at DESC
+                LIMIT 1
+            )
+        ) AS r
+        WHERE COALESCE(r.last_seen_at, r.scraped_at) >= t.hour
+        GROUP BY t.project, t.hour
+    ),
+    upserted AS (
+        INSERT INTO snapshot_hourly (
+            project, hour,
+            first_at, first_amount, first_quantity,
+            last_at, last_amount, last_quantity,
+            max_amount, max_quantity, samples
+        )
+        SELECT * FROM agg
+        ON CONFLICT (project, hour) DO UPDATE SET
+            first_at = EXCLUDED.first_at,
+            first_amount = EXCLUDED.first_amount,
+            first_quantity = EXCLUDED.first_quantity,
+            last_at = EXCLUDED.last_at,
+            last_amount = EXCLUDED.last_amount,
+            last_quantity = EXCLUDED.last_quantity,
+            max_amount = EXCLUDED.max_amount,
+            max_quantity = EXCLUDED.max_quantity,
+            samples = EXCLUDED.samples
+        RETURNING 1
+    ),
+    -- 桶里的快照都被删掉了（例如重新解析后）则删除该桶
+    emptied AS (
+        DELETE FROM snapshot_hourly h
+        USING touched t
+        WHERE h.project = t.project AND h.hour = t.hour
+          AND NOT EXISTS (SELECT 1 FROM agg WHERE agg.project = t.project AND agg.hour = t.hour)
+        RETURNING 1
     )
+"""
+
+
+@timed("db.refresh_hourly_rollup")
+def refresh_hourly_rollup() -> RollupStats:
+    """
+    增量维护 snapshot_hourly：重算「水位 - ROLLUP_LOOKBACK」之后被快照覆盖的小时桶，再把水位推进到本事务的开始时间。
+    按时间而不是按自增 id 找新数据：id 较小的事务晚提交、或者 extend 模式只延长 last_seen_at 时，都不会被漏掉。
+    回看窗口覆盖抓取到提交之间的延迟；写入更早时间的数据（import-snapshots / reparse）需要对该时间段调用 rebuild_hourly_rollup。
+    水位更新与桶的写入在同一事务里，并对水位行加锁，多个进程同时执行时会依次进行。
+    """
+    stats = RollupStats()
+    start = time.perf_counter()
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO rollup_watermarks (name) VALUES (%s) ON CONFLICT (name) DO NOTHING;",
+            (HOURLY_ROLLUP,),
+        )
+        cur.execute(
+            "SELECT covered_until, NOW() FROM rollup_watermarks WHERE name = %s FOR UPDATE;",
+            (HOURLY_ROLLUP,),
+        )
+        covered_until, now = cur.fetchone()
+        # 从未构建过时从头开始
+        since = covered_until - timedelta(seconds=settings.rollup_lookback) if covered_until else "-infinity"
+        cur.execute(
+            "WITH RECURSIVE "
+            + _ROLLUP_SPAN_HOURS
+            + """
+            touched AS (SELECT DISTINCT project, hour FROM span_hours),
+            """
+            + _HOURLY_ROLLUP_UPSERT
+            + """
+            SELECT
+                (SELECT COUNT(*) FROM spans),
+                (SELECT COUNT(*) FROM upserted) + (SELECT COUNT(*) FROM emptied);
+            """,
+            {"since": since, "hours_from": "-infinity", "until": "infinity", "project": None},
+        )
+        stats.rows, stats.buckets = cur.fetchone()
+        cur.execute(
+            "UPDATE rollup_watermarks SET covered_until = %s, updated_at = NOW() WHERE name = %s;",
+            (now, HOURLY_ROLLUP),
+        )
+        stats.covered_until = now
+    stats.seconds = time.perf_counter() - start
+    if stats.rows:
+        logger.info(
+            "Hourly rollup: %d snapshots, %d buckets, covered until %s (%.3fs)",
+            stats.rows,
+            stats.buckets,
+            stats.covered_until.isoformat(),
+            stats.seconds,
+        )
+    return stats
+
+
+@timed("db.rebuild_hourly_rollup")
+def rebuild_hourly_rollup(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    project: Optional[str] = None,
+) -> RollupStats:
+    """
+    重算 [start, end) 内的小时桶（原有快照被改写或补录后使用，例如 reparse、import-snapshots）。
+    不给时间范围时清空 snapshot_hourly、把水位清空后从头构建。
+    """
+    if start is None and end is None and project is None:
+        with pooled_conn() as conn, conn.cursor() as cur:
+            cur.execute("TRUNCATE snapshot_hourly;")
+            cur.execute(
+                """
+                INSERT INTO rollup_watermarks (name, covered_until) VALUES (%s, NULL)
+                ON CONFLICT (name) DO UPDATE SET covered_until = NULL, updated_at = NOW();
+                """,
+                (HOURLY_ROLLUP,),
+            )
+        return refresh_hourly_rollup()
+
+    stats = RollupStats()
+    began = time.perf_counter()
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "WITH RECURSIVE "
+            + _ROLLUP_SPAN_HOURS
+            + """
+            touched AS (
+                SELECT project, hour FROM span_hours
+                UNION
+                SELECT project, hour
+                FROM snapshot_hourly
+                WHERE hour >= date_trunc('hour', %(since)s::timestamptz AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+                  AND hour < %(until)s::timestamptz
+                  AND (%(project)s::text IS NULL OR project = %(project)s)
+            ),
+            """
+            + _HOURLY_ROLLUP_UPSERT
+            + """
+            SELECT
+                (SELECT COUNT(*) FROM spans),
+                (SELECT COUNT(*) FROM upserted) + (SELECT COUNT(*) FROM emptied);
+            """,
+            {
+                "since": start or datetime(1970, 1, 1, tzinfo=timezone.utc),
+                "hours_from": start or datetime(1970, 1, 1, tzinfo=timezone.utc),
+                "until": end or datetime.now(timezone.utc) + timedelta(days=1),
+                "project": project,
+            },
+        )
+        stats.rows, stats.buckets = cur.fetchone()
+    stats.seconds = time.perf_counter() - began
+    return stats
+
 
+def _rollup_rows(rows) -> list[SnapshotRollup]:
+    return [SnapshotRollup(**row) for row in rows]
 
+
+@timed("db.get_hourly_rollup")
+def get_hourly_rollup(start: datetime, end: datetime, project: Optional[str] = None) -> list[SnapshotRollup]:
+    """[start, end) 内的小时汇总，按小时升序（走主键索引，一周只有 168 行）。"""
+    with pooled_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            SELECT project, hour AS period,
+                   first_at, first_amount, first_quantity,
+                   last_at, last_amount, last_quantity,
+                   max_amount, max_quantity, samples
+            FROM snapshot_hourly
+            WHERE project = %s AND hour >= %s AND hour < %s
+            ORDER BY hour;
+            """,
+            (project or settings.default_project, start, end),
+        )
+        return _rollup_rows(cur.fetchall())
+
+
+@timed("db.get_daily_rollup")
+def get_daily_rollup(start, end, project: Optional[str] = None) -> list[SnapshotRollup]:
+    """
+    由小时汇总合成的按日汇总，start/end 为本地日期（闭区间）。
+    与战报一致，本地日期 D 指 D-1 日 23:00 到 D 日 23:00 这段时间。
+    小时桶按快照的覆盖区间生成，所以 first_* 是日界时仍然有效的数值（从前一天延续下来）；
+    只有抓取中断、没有任何快照覆盖的小时没有桶。
+    """
+    with pooled_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            SELECT project, day AS period,
+                   MIN(first_at) AS first_at,
+                   (ARRAY_AGG(first_amount ORDER BY hour))[1] AS first_amount,
+                   (ARRAY_AGG(first_quantity ORDER BY hour))[1] AS first_quantity,
+                   MAX(last_at) AS last_at,
+                   (ARRAY_AGG(last_amount ORDER BY hour DESC))[1] AS last_amount,
+                   (ARRAY_AGG(last_quantity ORDER BY hour DESC))[1] AS last_quantity,
+                   MAX(max_amount) AS max_amount,
+                   MAX(max_quantity) AS max_quantity,
+                   SUM(samples)::integer AS samples
+            FROM (
+                SELECT *, ((hour AT TIME ZONE %(tz)s) + INTERVAL '1 hour')::date AS day
+                FROM snapshot_hourly
+                WHERE project = %(project)s
+                  AND hour >= ((%(start)s::date - 1) + TIME '23:00') AT TIME ZONE %(tz)s
+                  AND hour < (%(end)s::date + TIME '23:00') AT TIME ZONE %(tz)s
+            ) AS h
+            GROUP BY project, day
+            ORDER BY day;
+            """,
+            {"project": project or settings.default_project, "tz": settings.timezone, "start": start, "end": end},
+        )
+        return _rollup_rows(cur.fetchall())
+
+
+@timed("db.upsert_daily_metrics")
 def upsert_daily_metrics(
     date,
     baseline_amount, baseline_quantity,
@@ -138,18 +1138,19 @@ def upsert_daily_metrics(
     goal_total_amount=0, goal_total_quantity=0,
     diff_daily_amount=0, diff_daily_quantity=0,
     diff_total_amount=0, diff_total_quantity=0,
+    project: Optional[str] = None,
 ):
     # 1. 在 Python 层面计算出老字段的值，防止数据库报错
     # 逻辑：今日新增 = 今日最终 - 昨日基准
     calc_sales_amount_today = end_amount - baseline_amount
     calc_sales_quantity_today = end_quantity - baseline_quantity
 
-    with get_conn() as conn:
+    with pooled_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
                 INSERT INTO daily_metrics (
-                    date, 
+                    project, date, 
                     baseline_amount, baseline_quantity,
                     end_amount, end_quantity,
                     
@@ -164,7 +1165,7 @@ def upsert_daily_metrics(
                     updated_at
                 )
                 VALUES (
-                    %s, 
+                    %s, %s, 
                     %s, %s, 
                     %s, %s, 
                     
@@ -174,7 +1175,7 @@ def upsert_daily_metrics(
                     %s, %s, %s, %s, %s, %s, %s, %s,
                     NOW()
                 )
-                ON CONFLICT (date) DO UPDATE SET
+                ON CONFLICT (project, date) DO UPDATE SET
                     baseline_amount = EXCLUDED.baseline_amount,
                     baseline_quantity = EXCLUDED.baseline_quantity,
                     end_amount = EXCLUDED.end_amount,
@@ -195,7 +1196,7 @@ def upsert_daily_metrics(
                     updated_at = NOW();
                 """,
                 (
-                    date,
+                    project or settings.default_project, date,
                     baseline_amount, baseline_quantity,
                     end_amount, end_quantity,
                     
@@ -208,3 +1209,353 @@ def upsert_daily_metrics(
                     diff_total_amount, diff_total_quantity
                 ),
             )
+
+
+def _boundary_snapshot(row, prefix: str) -> Optional[SnapshotRow]:
+    if row is None or row[f"{prefix}_id"] is None:
+        return None
+    return SnapshotRow(
+        id=row[f"{prefix}_id"],
+        project=row["project"],
+        scraped_at=row[f"{prefix}_scraped_at"],
+        total_amount=row[f"{prefix}_total_amount"],
+        total_quantity=row[f"{prefix}_total_quantity"],
+        last_seen_at=row[f"{prefix}_last_seen_at"],
+    )
+
+
+# 一次查询同时取「基准时刻」和「最新时刻」之前的最后一条快照，两个子查询各走一次索引
+_BOUNDARY_CTES = """
+    baseline AS (
+        SELECT id, scraped_at, total_amount, total_quantity, last_seen_at
+        FROM raw_snapshots
+        WHERE project = %(project)s AND scraped_at <= %(baseline_at)s
+        ORDER BY scraped_at DESC
+        LIMIT 1
+    ),
+    latest AS (
+        SELECT id, scraped_at, total_amount, total_quantity, last_seen_at
+        FROM raw_snapshots
+        WHERE project = %(project)s AND scraped_at <= %(latest_at)s
+        ORDER BY scraped_at DESC
+        LIMIT 1
+    )
+"""
+
+_BOUNDARY_SELECT = """
+    SELECT
+        %(project)s AS project,
+        b.id AS baseline_id, b.scraped_at AS baseline_scraped_at,
+        b.total_amount AS baseline_total_amount, b.total_quantity AS baseline_total_quantity,
+        b.last_seen_at AS baseline_last_seen_at,
+        l.id AS latest_id, l.scraped_at AS latest_scraped_at,
+        l.total_amount AS latest_total_amount, l.total_quantity AS latest_total_quantity,
+        l.last_seen_at AS latest_last_seen_at
+    FROM (SELECT 1) AS one
+    LEFT JOIN baseline b ON TRUE
+    LEFT JOIN latest l ON TRUE;
+"""
+
+
+@timed("db.get_boundary_snapshots")
+def get_boundary_snapshots(
+    baseline_at: datetime,
+    latest_at: datetime,
+    project: Optional[str] = None,
+) -> tuple[Optional[SnapshotRow], Optional[SnapshotRow]]:
+    """
+    一次往返取回 (baseline_at 之前最后一条, latest_at 之前最后一条) 两个快照。
+    """
+    params = {
+        "project": project or settings.default_project,
+        "baseline_at": baseline_at,
+        "latest_at": latest_at,
+    }
+    with pooled_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("WITH " + _BOUNDARY_CTES + _BOUNDARY_SELECT, params)
+        row = cur.fetchone()
+    return _boundary_snapshot(row, "baseline"), _boundary_snapshot(row, "latest")
+
+
+_DAILY_METRICS_COLUMNS = """(
+    project, date,
+    baseline_amount, baseline_quantity,
+    end_amount, end_quantity,
+    sales_amount_today, sales_quantity_today,
+    goal_daily_amount, goal_daily_quantity,
+    goal_total_amount, goal_total_quantity,
+    diff_daily_amount, diff_daily_quantity,
+    diff_total_amount, diff_total_quantity,
+    updated_at
+)"""
+
+_DAILY_METRICS_ON_CONFLICT = """
+    ON CONFLICT (project, date) DO UPDATE SET
+        baseline_amount = EXCLUDED.baseline_amount,
+        baseline_quantity = EXCLUDED.baseline_quantity,
+        end_amount = EXCLUDED.end_amount,
+        end_quantity = EXCLUDED.end_quantity,
+        sales_amount_today = EXCLUDED.sales_amount_today,
+        sales_quantity_today = EXCLUDED.sales_quantity_today,
+        goal_daily_amount = EXCLUDED.goal_daily_amount,
+        goal_daily_quantity = EXCLUDED.goal_daily_quantity,
+        goal_total_amount = EXCLUDED.goal_total_amount,
+        goal_total_quantity = EXCLUDED.goal_total_quantity,
+        diff_daily_amount = EXCLUDED.diff_daily_amount,
+        diff_daily_quantity = EXCLUDED.diff_daily_quantity,
+        diff_total_amount = EXCLUDED.diff_total_amount,
+        diff_total_quantity = EXCLUDED.diff_total_quantity,
+        updated_at = NOW()
+"""
+
+
+@timed("db.finalize_daily_metrics")
+def finalize_daily_metrics(
+    date,
+    baseline_at: datetime,
+    latest_at: datetime,
+    goal_daily_amount=0, goal_daily_quantity=0,
+    goal_total_amount=0, goal_total_quantity=0,
+    project: Optional[str] = None,
+) -> tuple[Optional[SnapshotRow], Optional[SnapshotRow]]:
+    """
+    在同一条 SQL（同一事务、一次往返）里取基准/最新快照，算出差值并写入 daily_metrics。
+    任一快照缺失时不会写入，返回值与 get_boundary_snapshots 相同。
+    """
+    params = {
+        "project": project or settings.default_project,
+        "baseline_at": baseline_at,
+        "latest_at": latest_at,
+        "date": date,
+        "goal_daily_amount": goal_daily_amount,
+        "goal_daily_quantity": goal_daily_quantity,
+        "goal_total_amount": goal_total_amount,
+        "goal_total_quantity": goal_total_quantity,
+    }
+    with pooled_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "WITH "
+            + _BOUNDARY_CTES
+            + """,
+            upsert AS (
+                INSERT INTO daily_metrics """ + _DAILY_METRICS_COLUMNS + """
+                SELECT
+                    %(project)s, %(date)s,
+                    b.total_amount, b.total_quantity,
+                    l.total_amount, l.total_quantity,
+                    l.total_amount - b.total_amount, l.total_quantity - b.total_quantity,
+                    %(goal_daily_amount)s, %(goal_daily_quantity)s,
+                    %(goal_total_amount)s, %(goal_total_quantity)s,
+                    %(goal_daily_amount)s - (l.total_amount - b.total_amount),
+                    %(goal_daily_quantity)s - (l.total_quantity - b.total_quantity),
+                    %(goal_total_amount)s - l.total_amount,
+                    %(goal_total_quantity)s - l.total_quantity,
+                    NOW()
+                FROM baseline b CROSS JOIN latest l
+                """ + _DAILY_METRICS_ON_CONFLICT + """
+                RETURNING date
+            )
+            """
+            + _BOUNDARY_SELECT,
+            params,
+        )
+        row = cur.fetchone()
+    return _boundary_snapshot(row, "baseline"), _boundary_snapshot(row, "latest")
+
+
+# 每个日界（本地 23:00）只做一次 LATERAL 索引探测取「该时刻之前最后一条快照」，
+# 当天的基准就是前一个日界的结果，用 LAG 窗口函数取得，因此 N 天只需 N+1 次探测。
+# 还没到的日界截断到 now，基准时刻还没到的日子不写入。
+_RECOMPUTE_DAILY_SQL = """
+    WITH days AS (
+        SELECT
+            d::date AS day,
+            LEAST((d::date + TIME '23:00') AT TIME ZONE %(tz)s, %(now)s) AS boundary_at
+        FROM generate_series(%(start)s::date - 1, %(end)s::date, INTERVAL '1 day') AS d
+    ),
+    boundaries AS (
+        SELECT days.day, days.boundary_at, s.total_amount, s.total_quantity
+        FROM days
+        LEFT JOIN LATERAL (
+            SELECT total_amount, total_quantity
+            FROM raw_snapshots
+            WHERE project = %(project)s AND scraped_at <= days.boundary_at
+            ORDER BY scraped_at DESC
+            LIMIT 1
+        ) AS s ON TRUE
+    ),
+    spans AS (
+        SELECT
+            day,
+            LAG(boundary_at) OVER w AS baseline_at,
+            LAG(total_amount) OVER w AS baseline_amount,
+            LAG(total_quantity) OVER w AS baseline_quantity,
+            total_amount AS end_amount,
+            total_quantity AS end_quantity
+        FROM boundaries
+        WINDOW w AS (ORDER BY day)
+    ),
+    targets AS (
+        SELECT *
+        FROM unnest(
+            %(t_date)s::date[],
+            %(t_daily_amount)s::bigint[], %(t_daily_quantity)s::integer[],
+            %(t_total_amount)s::bigint[], %(t_total_quantity)s::integer[]
+        ) AS t(day, goal_daily_amount, goal_daily_quantity, goal_total_amount, goal_total_quantity)
+    ),
+    rows AS (
+        SELECT
+            s.day, s.baseline_amount, s.baseline_quantity, s.end_amount, s.end_quantity,
+            COALESCE(t.goal_daily_amount, 0) AS goal_daily_amount,
+            COALESCE(t.goal_daily_quantity, 0) AS goal_daily_quantity,
+            COALESCE(t.goal_total_amount, 0) AS goal_total_amount,
+            COALESCE(t.goal_total_quantity, 0) AS goal_total_quantity
+        FROM spans s
+        LEFT JOIN targets t ON t.day = s.day
+        WHERE s.day >= %(start)s
+          AND s.baseline_at < %(now)s
+          AND s.baseline_amount IS NOT NULL
+          AND s.end_amount IS NOT NULL
+    )
+    INSERT INTO daily_metrics """ + _DAILY_METRICS_COLUMNS + """
+    SELECT
+        %(project)s, day,
+        baseline_amount, baseline_quantity,
+        end_amount, end_quantity,
+        end_amount - baseline_amount, end_quantity - baseline_quantity,
+        goal_daily_amount, goal_daily_quantity,
+        goal_total_amount, goal_total_quantity,
+        goal_daily_amount - (end_amount - baseline_amount),
+        goal_daily_quantity - (end_quantity - baseline_quantity),
+        goal_total_amount - end_amount,
+        goal_total_quantity - end_quantity,
+        NOW()
+    FROM rows
+    """ + _DAILY_METRICS_ON_CONFLICT + """
+    RETURNING date;
+"""
+
+
+@timed("db.recompute_daily_metrics")
+def recompute_daily_metrics(
+    start,
+    end,
+    targets: Iterable = (),
+    now: Optional[datetime] = None,
+    project: Optional[str] = None,
+) -> list:
+    """
+    用一条 SQL 重算 [start, end] 每一天的 daily_metrics 并批量 upsert。
+    每天的基准 = 前一天本地 23:00 之前最后一条快照，结束值 = 当天 23:00（或 now）之前最后一条快照，
+    与下一天的基准是同一条，因此各天的新增量首尾相接。
+    targets 为 DailyTarget 列表（没有目标的日子按 0 计）。返回实际写入的日期。
+    """
+    targets = list(targets)
+    params = {
+        "project": project or settings.default_project,
+        "tz": settings.timezone,
+        "now": now or datetime.now(timezone.utc),
+        "start": start,
+        "end": end,
+        "t_date": [t.date for t in targets],
+        "t_daily_amount": [t.goal_daily_amount for t in targets],
+        "t_daily_quantity": [t.goal_daily_quantity for t in targets],
+        "t_total_amount": [t.goal_total_amount for t in targets],
+        "t_total_quantity": [t.goal_total_quantity for t in targets],
+    }
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(_RECOMPUTE_DAILY_SQL, params)
+        return sorted(row[0] for row in cur.fetchall())
+
+
+@dataclass
+class PlanCheck:
+    name: str
+    node_types: list[str]
+    heap_fetches: int
+    execution_ms: float
+    plan_text: str
+
+    @property
+    def ok(self) -> bool:
+        # 要求走 (project, scraped_at) 索引，且不出现全表扫描。last_seen_at 不在索引里（见 RAW_SNAPSHOTS_INDEXES），
+        # 所以不一定是 Index Only Scan；命中行分散在多页时规划器会选位图扫描，按物理位置取行后再对这几行排序，可以接受
+        return (
+            any(node in self.node_types for node in ("Index Scan", "Index Only Scan", "Bitmap Index Scan"))
+            and "Seq Scan" not in self.node_types
+            and ("Sort" not in self.node_types or "Bitmap Heap Scan" in self.node_types)
+        )
+
+
+def _walk_plan(node: dict, depth: int = 0) -> Iterator[tuple[int, dict]]:
+    yield depth, node
+    for child in node.get("Plans", []):
+        yield from _walk_plan(child, depth + 1)
+
+
+def _create_synthetic_snapshots(cur, rows: int, project: str, now: datetime) -> None:
+    # 临时表与正式表同名，会在当前会话的 search_path 里遮住正式表，
+    # 因此后面的 EXPLAIN 可以原样使用业务 SQL
+    cur.execute("CREATE TEMP TABLE raw_snapshots (LIKE raw_snapshots INCLUDING ALL);")
+    cur.execute(
+        """
+        INSERT INTO pg_temp.raw_snapshots (id, project, scraped_at, total_amount, total_quantity)
+        SELECT g,
+               CASE WHEN g %% 50 = 0 THEN %s ELSE 'synthetic_' || (g %% 50) END,
+               %s - g * interval '72 seconds',
+               1000000 + g,
+               100 + g / 1000
+        FROM generate_series(1, %s) AS g;
+        """,
+        (project, now, rows),
+    )
+    cur.execute("VACUUM ANALYZE pg_temp.raw_snapshots;")
+
+
+def explain_snapshot_lookups(project: Optional[str] = None, synthetic_rows: int = 0) -> list[PlanCheck]:
+    """
+    对 get_last_snapshot_before / get_snapshots_between 的 SQL 执行 EXPLAIN ANALYZE，
+    返回各自的执行计划节点。synthetic_rows > 0 时先在会话临时表里生成相应行数的
+    模拟数据（50 个项目、按时间追加），用来验证数据量增长后仍然走索引。
+    """
+    project = project or settings.default_project
+    now = datetime.now(timezone.utc)
+    lookups = [
+        ("get_last_snapshot_before", _LAST_SNAPSHOT_BEFORE_SQL, (project, now)),
+        ("get_snapshots_between", _SNAPSHOTS_BETWEEN_SQL, (project, now - timedelta(days=1), now)),
+    ]
+
+    checks: list[PlanCheck] = []
+    with pooled_conn(autocommit=True) as conn, conn.cursor() as cur:
+        try:
+            if synthetic_rows > 0:
+                _create_synthetic_snapshots(cur, synthetic_rows, project, now)
+            for name, query, params in lookups:
+                cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query.strip().rstrip(";"), params)
+                result = cur.fetchone()[0][0]
+                nodes = list(_walk_plan(result["Plan"]))
+                checks.append(
+                    PlanCheck(
+                        name=name,
+                        node_types=[node["Node Type"] for _, node in nodes],
+                        heap_fetches=sum(node.get("Heap Fetches", 0) for _, node in nodes),
+                        execution_ms=result.get("Execution Time", 0.0),
+                        plan_text="\n".join(
+                            "  " * depth
+                            + f"-> {node['Node Type']}"
+                            + (f" using {node['Index Name']}" if "Index Name" in node else "")
+                            + f" (rows={node.get('Actual Rows')})"
+                            for depth, node in nodes
+                        ),
+                    )
+                )
+        finally:
+            if synthetic_rows > 0:
+                try:
+                    cur.execute("DROP TABLE IF EXISTS pg_temp.raw_snapshots;")
+                except psycopg2.Error as exc:
+                    # 删不掉临时表就关掉连接：临时表随会话消失，pooled_conn 也会丢弃这个连接，
+                    # 否则它会一直遮住正式表，被之后借到这个连接的业务代码读写
+                    logger.warning("Failed to drop synthetic raw_snapshots, closing connection: %s", exc)
+                    conn.close()
+    return checks
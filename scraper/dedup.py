@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from .config import settings
+from .db import claim_event, prune_events, release_event
+
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryDedupStore:
+    """
+    进程内的 LRU + TTL 去重表，seen() 为 O(1)。
+    超过 max_entries 时淘汰最久未写入的键。
+    """
+
+    def __init__(self, max_entries: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._expires: OrderedDict[str, float] = OrderedDict()
+
+    def seen(self, key: str) -> bool:
+        """已见过（且未过期）返回 True；否则登记该键并返回 False。"""
+        now = self.clock()
+        with self._lock:
+            expires_at = self._expires.get(key)
+            if expires_at is not None and expires_at > now:
+                return True
+            self._expires[key] = now + self.ttl
+            self._expires.move_to_end(key)
+            while len(self._expires) > self.max_entries:
+                self._expires.popitem(last=False)
+            return False
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            self._expires.pop(key, None)
+
+
+class PostgresDedupStore:
+    """
+    多副本共享的去重表：先查本地内存（重放直接丢弃，不碰数据库），
+    本地没见过再到 processed_events 表里抢占登记。
+    """
+
+    # 每登记这么多次清理一次过期记录
+    PRUNE_EVERY = 200
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.ttl = ttl
+        self.memory = MemoryDedupStore(max_entries, ttl)
+        self._claims = 0
+
+    def seen(self, key: str) -> bool:
+        if self.memory.seen(key):
+            return True
+        try:
+            claimed = claim_event(key)
+        except Exception as exc:  # noqa: BLE001 - 数据库不可用时退化为仅内存去重
+            logger.warning("Dedup claim failed, falling back to memory only: %s", exc)
+            return False
+        self._claims += 1
+        if self._claims % self.PRUNE_EVERY == 0:
+            try:
+                prune_events(datetime.now(timezone.utc) - timedelta(seconds=self.ttl))
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("Dedup prune failed: %s", exc)
+        return not claimed
+
+    def forget(self, key: str) -> None:
+        self.memory.forget(key)
+        try:
+            release_event(key)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Dedup release failed: %s", exc)
+
+
+def create_dedup_store():
+    if settings.dedup_backend == "postgres":
+        return PostgresDedupStore(settings.dedup_max_entries, settings.dedup_ttl)
+    if settings.dedup_backend != "memory":
+        raise ValueError(f"Unknown DEDUP_BACKEND: {settings.dedup_backend}")
+    return MemoryDedupStore(settings.dedup_max_entries, settings.dedup_ttl)
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from .config import settings
+from .logic import fetch_metrics, store_snapshots
+from .parser import SnapshotMetrics
+from .projects import Project, load_projects
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProjectResult:
+    project: Project
+    metrics: SnapshotMetrics | None = None
+    error: Exception | None = None
+    elapsed: float = 0.0  # 秒
+    fetched_at: datetime | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class HostRateLimiter:
+    """
+    按域名限速：同一 host 的两次请求之间至少间隔 min_interval 秒。
+    多个线程同时请求时按到达顺序依次排队。
+    """
+
+    def __init__(self, min_interval: float) -> None:
+        self.min_interval = min_interval
+        self._next_slot: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        if self.min_interval <= 0:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + self.min_interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _fetch_project(project: Project, limiter: HostRateLimiter) -> ProjectResult:
+    start = time.perf_counter()
+    try:
+        limiter.wait(project.url)
+        fetched_at = datetime.now(timezone.utc)
+        metrics = fetch_metrics(project, fetched_at)
+        return ProjectResult(
+            project=project,
+            metrics=metrics,
+            elapsed=time.perf_counter() - start,
+            fetched_at=fetched_at,
+        )
+    except Exception as exc:  # noqa: BLE001 - 单个项目失败不影响其他项目
+        logger.warning("Fetch failed for project %s: %s", project.slug, exc)
+        return ProjectResult(project=project, error=exc, elapsed=time.perf_counter() - start)
+
+
+def scrape_all(
+    projects: list[Project] | None = None,
+    max_workers: int | None = None,
+    limiter: HostRateLimiter | None = None,
+) -> list[ProjectResult]:
+    """
+    并发抓取并解析所有注册项目，再把成功的结果一次性批量写入 raw_snapshots。
+    抓取在线程池中进行（并发数受 max_workers 限制，同域名受 limiter 限速）；
+    任何一个项目抓取失败都只记录在它自己的 ProjectResult 里。
+    """
+    projects = projects if projects is not None else load_projects()
+    if not projects:
+        return []
+    max_workers = max_workers or settings.scrape_concurrency
+    limiter = limiter or HostRateLimiter(settings.per_host_min_interval)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(projects))) as pool:
+        futures = [pool.submit(_fetch_project, project, limiter) for project in projects]
+        results = [future.result() for future in as_completed(futures)]
+
+    succeeded = [result for result in results if result.ok]
+    if succeeded:
+        try:
+            store_snapshots([(r.project, r.metrics, r.fetched_at) for r in succeeded])
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Storing %d snapshots failed: %s", len(succeeded), exc)
+            for result in succeeded:
+                result.error = exc
+
+    order = {project.slug: i for i, project in enumerate(projects)}
+    results.sort(key=lambda r: order[r.project.slug])
+    return results
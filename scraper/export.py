@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import csv
+import json
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterable, Sequence
+
+# Parquet 需要可选的 pyarrow；CSV/NDJSON 只用标准库
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - 取决于部署环境
+    pa = None
+    pq = None
+
+FORMATS = ("csv", "ndjson", "parquet")
+
+# Parquet 各列的类型：不能从第一批数据推断，例如 dedup 之前的历史快照 last_seen_at 全是 NULL，
+# 推断成 null 类型后，后面带时间的批次就写不进去了
+_PARQUET_TYPES = {
+    "id": "int64",
+    "project": "string",
+    "date": "date32",
+    "scraped_at": "timestamp",
+    "last_seen_at": "timestamp",
+    "updated_at": "timestamp",
+}
+_SUFFIX_FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".parquet": "parquet"}
+
+
+@dataclass
+class ExportStats:
+    rows: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def guess_format(path: str | None) -> str:
+    if path and path != "-":
+        fmt = _SUFFIX_FORMATS.get(Path(path).suffix.lower())
+        if fmt:
+            return fmt
+    return "csv"
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@contextmanager
+def _open_text(path: str | None):
+    if not path or path == "-":
+        yield sys.stdout
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        yield f
+
+
+def _write_csv(rows: Iterable[Sequence], columns: Sequence[str], path: str | None, stats: ExportStats) -> None:
+    with _open_text(path) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(value.isoformat() if isinstance(value, (datetime, date)) else value for value in row)
+            stats.rows += 1
+
+
+def _write_ndjson(rows: Iterable[Sequence], columns: Sequence[str], path: str | None, stats: ExportStats) -> None:
+    with _open_text(path) as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default))
+            f.write("\n")
+            stats.rows += 1
+
+
+def parquet_schema(columns: Sequence[str]):
+    """导出列对应的 pyarrow schema：时间为 UTC 微秒时间戳，金额/人数等数值列为 int64。"""
+    types = {
+        "int64": pa.int64(),
+        "string": pa.string(),
+        "date32": pa.date32(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }
+    return pa.schema([(name, types[_PARQUET_TYPES.get(name, "int64")]) for name in columns])
+
+
+def _write_parquet(
+    rows: Iterable[Sequence],
+    columns: Sequence[str],
+    path: str | None,
+    stats: ExportStats,
+    batch_rows: int,
+) -> None:
+    if pq is None:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    if not path or path == "-":
+        raise ValueError("Parquet export needs an output file (-o PATH)")
+    schema = parquet_schema(columns)
+    batch: list[dict] = []
+
+    def flush() -> None:
+        # 每批按固定 schema 写一个 row group
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        batch.clear()
+
+    with pq.ParquetWriter(path, schema) as writer:
+        for row in rows:
+            batch.append(dict(zip(columns, row)))
+            stats.rows += 1
+            if len(batch) >= batch_rows:
+                flush()
+        if batch:
+            flush()
+
+
+def export_rows(
+    rows: Iterable[Sequence],
+    columns: Sequence[str],
+    path: str | None = None,
+    fmt: str | None = None,
+    batch_rows: int = 50000,
+) -> ExportStats:
+    """
+    把一行行的元组流式写成 CSV / NDJSON / Parquet，内存占用只与 batch_rows（Parquet 的 row group 大小）有关。
+    path 为 None 或 "-" 时写到标准输出（Parquet 除外）。
+    """
+    fmt = fmt or guess_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    stats = ExportStats()
+    start = time.perf_counter()
+    if fmt == "csv":
+        _write_csv(rows, columns, path, stats)
+    elif fmt == "ndjson":
+        _write_ndjson(rows, columns, path, stats)
+    else:
+        _write_parquet(rows, columns, path, stats, batch_rows)
+    stats.seconds = time.perf_counter() - start
+    if path and path != "-":
+        stats.bytes = Path(path).stat().st_size
+    return stats
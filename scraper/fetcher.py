@@ -1,36 +1,122 @@
+import threading
+from dataclasses import dataclass
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from .config import settings
+from .metrics import timed
 
 
 class FetchError(Exception):
     pass
 
 
-def fetch_page(url: Optional[str] = None) -> str:
+USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/123.0 Safari/537.36"
+)
+
+# urllib3 只有在安装了 brotli 时才能解码 br，否则只声明 gzip/deflate
+try:
+    import brotli  # noqa: F401
+
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:  # pragma: no cover - 取决于部署环境
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+@dataclass
+class FetchResult:
+    url: str
+    text: Optional[str]  # 304 时为 None，调用方应复用上一次的解析结果
+    not_modified: bool = False
+
+
+@dataclass
+class _Validators:
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+# url -> 上一次 200 响应带回的 ETag / Last-Modified
+_validators: dict[str, _Validators] = {}
+
+
+def get_session() -> requests.Session:
     """
-    抓取目标页面 HTML 文本，带简单重试。
+    进程级复用的 HTTP 会话：保持 keep-alive 连接，省去每次请求的 DNS/TCP/TLS 开销。
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.http_pool_connections,
+                    pool_maxsize=settings.http_pool_maxsize,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(
+                    {
+                        "User-Agent": USER_AGENT,
+                        "Accept-Encoding": ACCEPT_ENCODING,
+                    }
+                )
+                _session = session
+    return _session
+
+
+def forget_validators(url: str) -> None:
+    """丢弃某个 URL 的缓存校验信息，下次请求将强制完整下载。"""
+    _validators.pop(url, None)
+
+
+@timed("fetch")
+def fetch_page_conditional(url: Optional[str] = None, conditional: bool = True) -> FetchResult:
+    """
+    抓取目标页面，带简单重试。
+    conditional=True 时携带 If-None-Match / If-Modified-Since，
+    服务端返回 304 则 FetchResult.not_modified 为 True 且不含正文。
     """
     target = url or settings.target_url
+    headers = {}
+    validators = _validators.get(target) if conditional else None
+    if validators is not None:
+        if validators.etag:
+            headers["If-None-Match"] = validators.etag
+        if validators.last_modified:
+            headers["If-Modified-Since"] = validators.last_modified
+
+    session = get_session()
     last_exc: Exception | None = None
     for attempt in range(3):
         try:
-            resp = requests.get(
-                target,
-                timeout=settings.request_timeout,
-                headers={
-                    "User-Agent": (
-                        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/123.0 Safari/537.36"
-                    )
-                },
-            )
+            resp = session.get(target, timeout=settings.request_timeout, headers=headers)
+            if resp.status_code == 304 and validators is not None:
+                return FetchResult(url=target, text=None, not_modified=True)
             resp.raise_for_status()
-            return resp.text
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            if etag or last_modified:
+                _validators[target] = _Validators(etag=etag, last_modified=last_modified)
+            else:
+                _validators.pop(target, None)
+            return FetchResult(url=target, text=resp.text)
         except Exception as exc:  # noqa: BLE001
             last_exc = exc
     raise FetchError(f"Failed to fetch page after retries: {last_exc}")
 
+
+def fetch_page(url: Optional[str] = None) -> str:
+    """
+    抓取目标页面 HTML 文本，带简单重试（总是完整下载）。
+    """
+    result = fetch_page_conditional(url, conditional=False)
+    assert result.text is not None
+    return result.text
@@ -4,27 +4,45 @@ import logging
 import sys
 
 # 务必确保引入了 finalize_today_metrics
-from .logic import finalize_today_metrics, scrape_once
+from .adaptive import AdaptiveTrigger
+from .config import settings
+from .db import refresh_hourly_rollup
+from .engine import scrape_all
+from .logic import finalize_today_metrics
+from .metrics import stage_metrics
+from .profiling import profiled
+from .scheduler import DailyTrigger, HourlyTrigger, Job
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@profiled("run_hourly")
 def run_hourly() -> None:
     """
     每小时由 Railway 定时任务调用：
-    1. 抓取最新数据快照
+    1. 并发抓取所有项目的最新数据快照
     2. 立即计算并更新今日的累计销量
+    3. 增量更新小时汇总表
     """
+    before = stage_metrics.snapshot()
     try:
-        # 第一步：抓取原始数据
-        metrics = scrape_once()
-        logger.info(
-            "Scraped snapshot: total_amount=%s, total_quantity=%s",
-            metrics.total_amount,
-            metrics.total_quantity,
-        )
+        # 第一步：抓取原始数据（单个项目失败只记日志，全部失败才算任务失败）
+        results = scrape_all()
+        for result in results:
+            if result.ok:
+                logger.info(
+                    "Scraped snapshot [%s]: total_amount=%s, total_quantity=%s (%.2fs)",
+                    result.project.slug,
+                    result.metrics.total_amount,
+                    result.metrics.total_quantity,
+                    result.elapsed,
+                )
+            else:
+                logger.error("Scrape failed [%s]: %s", result.project.slug, result.error)
+        if results and not any(result.ok for result in results):
+            raise RuntimeError("All project scrapes failed.")
 
         # 第二步：立即计算今日增量并存入数据库 (实时更新今日战况)
         daily = finalize_today_metrics()
@@ -35,16 +53,27 @@ def run_hourly() -> None:
                 daily.sales_amount_today
             )
 
+        # 第三步：把新快照并入小时汇总（失败不影响本次任务，下次会从水位继续）
+        try:
+            refresh_hourly_rollup()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Hourly rollup refresh failed: %s", exc)
+
     except Exception as exc:  # noqa: BLE001
         logger.exception("run_hourly failed: %s", exc)
         raise
+    finally:
+        # 与同时处理的 webhook 请求共用计数，摘要里可能混入少量并发调用
+        logger.info("run_hourly timings: %s", stage_metrics.summary(since=before))
 
 
+@profiled("compute_daily")
 def compute_daily() -> None:
     """
     每天 23:15 由 Railway 定时任务调用：
     作为每日最终结算的双保险
     """
+    before = stage_metrics.snapshot()
     try:
         metrics = finalize_today_metrics()
         if metrics is None:
@@ -58,15 +87,47 @@ def compute_daily() -> None:
     except Exception as exc:  # noqa: BLE001
         logger.exception("compute_daily failed: %s", exc)
         raise
+    finally:
+        logger.info("compute_daily timings: %s", stage_metrics.summary(since=before))
+
+
+def scheduled_jobs() -> list[Job]:
+    """app.py 常驻调度器托管的任务，对应原来 Railway Cron 的两条命令。"""
+    daily_hour, daily_minute = (int(part) for part in settings.scheduler_daily_at.split(":"))
+    if settings.scheduler_mode == "adaptive":
+        # 抓取间隔随销售速度在 ADAPTIVE_MIN_INTERVAL ~ ADAPTIVE_MAX_INTERVAL 之间变化
+        scrape_trigger = AdaptiveTrigger()
+    elif settings.scheduler_mode == "fixed":
+        scrape_trigger = HourlyTrigger(settings.scheduler_hourly_minute)
+    else:
+        raise ValueError(f"Unknown SCHEDULER_MODE: {settings.scheduler_mode}")
+    return [
+        Job(
+            name="run_hourly",
+            func=run_hourly,
+            trigger=scrape_trigger,
+            jitter=settings.scheduler_jitter,
+        ),
+        Job(
+            name="compute_daily",
+            func=compute_daily,
+            trigger=DailyTrigger(daily_hour, daily_minute),
+        ),
+    ]
 
 
 if __name__ == "__main__":
     # 命令行入口逻辑
-    if len(sys.argv) < 2:
-        print("Usage: python -m scraper.jobs [run_hourly|compute_daily]")
+    args = sys.argv[1:]
+    if "--profile" in args:
+        # 本次运行一定采样，结果写到 PROFILE_DIR
+        args.remove("--profile")
+        settings.profile_rate = 1.0
+    if len(args) != 1:
+        print("Usage: python -m scraper.jobs [run_hourly|compute_daily] [--profile]")
         raise SystemExit(1)
 
-    cmd = sys.argv[1]
+    cmd = args[0]
     if cmd == "run_hourly":
         run_hourly()
     elif cmd == "compute_daily":
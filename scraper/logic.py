@@ -1,19 +1,28 @@
 from __future__ import annotations
+import logging
 from dataclasses import dataclass
-from datetime import datetime, time, timedelta, timezone
+from datetime import date, datetime, time, timedelta, timezone
 import pytz
 
+from .archive import get_archive
 from .config import settings
 from .db import (
-    SnapshotRow, 
-    get_last_snapshot_before, 
-    upsert_daily_metrics, 
-    insert_snapshot  # 必须导入这个
+    SnapshotInput,
+    SnapshotRow,
+    extend_snapshots,
+    insert_snapshots,
+    finalize_daily_metrics,
+    get_boundary_snapshots,
+    get_last_snapshot_before,
+    recompute_daily_metrics,
 )
-from .fetcher import fetch_page
+from .fetcher import fetch_page_conditional, forget_validators
 from .parser import SnapshotMetrics, parse_metrics
-from .targets import get_target_for_date
+from .projects import Project, default_project
+from .report_cache import report_cache
+from .targets import DailyTarget, get_target_for_date, get_targets_between
 
+logger = logging.getLogger(__name__)
 tz_local = pytz.timezone(settings.timezone)
 
 @dataclass
@@ -40,64 +49,185 @@ class TodayMetrics:
     pct_total_quantity: float
 
 
-def scrape_once() -> SnapshotMetrics:
+# url -> 上一次成功解析的结果，配合条件请求在 304 时直接复用
+_last_parsed: dict[str, SnapshotMetrics] = {}
+# url -> 上一次归档页面的 sha256，304 时直接指向它
+_last_archived: dict[str, str] = {}
+
+
+def _archive_page(project: Project, fetched_at: datetime, html: str | None) -> None:
+    """归档失败只记日志，不影响抓取。"""
+    archive = get_archive()
+    if archive is None:
+        return
+    try:
+        if html is not None:
+            _last_archived[project.url] = archive.put(project.slug, project.url, fetched_at, html)
+        elif project.url in _last_archived:
+            archive.link(project.slug, project.url, fetched_at, _last_archived[project.url])
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("Archiving page for %s failed: %s", project.slug, exc)
+
+
+def fetch_metrics(project: Project | None = None, fetched_at: datetime | None = None) -> SnapshotMetrics:
     """
-    抓取一次页面并存入 raw_snapshots 表。
-    这是最基础的爬虫功能。
+    抓取并解析项目页面。页面未变化（304）时直接复用上一次的解析结果。
+    配置了 ARCHIVE_DIR 时，先把原始 HTML 以 fetched_at（应与写入快照的 scraped_at 相同）归档再解析，
+    这样即使 XPath 失效，之后也能从归档重新解析。
     """
-    html_text = fetch_page()
-    metrics = parse_metrics(html_text)
-    insert_snapshot(total_amount=metrics.total_amount, total_quantity=metrics.total_quantity)
+    project = project or default_project()
+    fetched_at = fetched_at or datetime.now(timezone.utc)
+    target = project.url
+    result = fetch_page_conditional(target)
+    if result.not_modified:
+        cached = _last_parsed.get(target)
+        if cached is not None:
+            _archive_page(project, fetched_at, None)
+            return cached
+        # 有校验信息却没有解析结果（例如上次解析失败），强制完整下载一次
+        forget_validators(target)
+        result = fetch_page_conditional(target, conditional=False)
+
+    _archive_page(project, fetched_at, result.text)
+    try:
+        metrics = parse_metrics(result.text, project.amount_xpath, project.quantity_xpath)
+    except Exception:
+        # 新页面的校验信息已经保存：不丢掉的话，下次 304 会把上一版页面的解析结果当成这一版返回
+        _last_parsed.pop(target, None)
+        forget_validators(target)
+        raise
+    _last_parsed[target] = metrics
     return metrics
 
 
-def finalize_today_metrics(now_utc: datetime | None = None) -> TodayMetrics | None:
+# project slug -> 最近一次写入（或延长）的快照；首次使用时从数据库取最新一行作为种子
+_last_written: dict[str, SnapshotRow | None] = {}
+
+
+def _last_written_for(project: str, now: datetime) -> SnapshotRow | None:
+    if project not in _last_written:
+        _last_written[project] = get_last_snapshot_before(now, project)
+    return _last_written[project]
+
+
+def store_snapshots(observations: list[tuple[Project, SnapshotMetrics, datetime]]) -> None:
     """
-    计算今日数据，对比目标，并更新 daily_metrics 表。
+    批量写入多个项目的观测 (project, metrics, scraped_at)。按 settings.snapshot_dedup：
+    - extend：与上一行数值相同则只把上一行的 last_seen_at 延长到本次时间
+    - skip：与上一行数值相同则不写
+    - off：每次都插入新行
+    get_last_snapshot_before 按 scraped_at 取「某时刻之前最后一行」，数值不变的区间只保留首行，
+    取到的数值与逐次插入时完全一致。
+    新行通过 insert_snapshots 一次批量写入，延长操作也合并成一条 UPDATE。
+    每个项目在一次调用中最多出现一次。
     """
-    if now_utc is None:
-        now_utc = datetime.now(timezone.utc)
+    mode = settings.snapshot_dedup
+    to_extend: dict[int, tuple[Project, datetime]] = {}
+    to_insert: list[tuple[Project, SnapshotMetrics, datetime]] = []
+    for project, metrics, scraped_at in observations:
+        last = _last_written_for(project.slug, scraped_at) if mode in ("extend", "skip") else None
+        unchanged = (
+            last is not None
+            and last.total_amount == metrics.total_amount
+            and last.total_quantity == metrics.total_quantity
+            and scraped_at > last.observed_at
+        )
+        if unchanged and mode == "skip":
+            continue
+        if unchanged:
+            to_extend[last.id] = (project, scraped_at)
+        else:
+            to_insert.append((project, metrics, scraped_at))
+
+    extended = extend_snapshots((snapshot_id, seen_at) for snapshot_id, (_, seen_at) in to_extend.items())
+    for snapshot_id, (project, seen_at) in to_extend.items():
+        if snapshot_id in extended:
+            _last_written[project.slug].last_seen_at = seen_at
+        else:
+            # 上一行已不是最新（例如别的进程写入了新快照），改为插入
+            to_insert.append((project, _metrics_of(_last_written[project.slug]), seen_at))
+
+    if to_insert:
+        _, inserted = insert_snapshots(
+            (
+                SnapshotInput(project.slug, scraped_at, metrics.total_amount, metrics.total_quantity)
+                for project, metrics, scraped_at in to_insert
+            ),
+            returning=True,
+        )
+        ids = {(project, scraped_at): snapshot_id for snapshot_id, project, scraped_at in inserted}
+        for project, metrics, scraped_at in to_insert:
+            _last_written[project.slug] = SnapshotRow(
+                id=ids[(project.slug, scraped_at)],
+                project=project.slug,
+                scraped_at=scraped_at,
+                total_amount=metrics.total_amount,
+                total_quantity=metrics.total_quantity,
+            )
 
-    # 1. 基础数据计算
+    for project in {project.slug for project, _, _ in observations}:
+        report_cache.invalidate(project)
+
+
+def _metrics_of(row: SnapshotRow) -> SnapshotMetrics:
+    return SnapshotMetrics(total_amount=row.total_amount, total_quantity=row.total_quantity)
+
+
+def store_snapshot(project: Project, metrics: SnapshotMetrics, scraped_at: datetime | None = None) -> None:
+    """写入单个项目的一次观测，规则见 store_snapshots。"""
+    store_snapshots([(project, metrics, scraped_at or datetime.now(timezone.utc))])
+
+
+def scrape_once(project: Project | None = None) -> SnapshotMetrics:
+    """
+    抓取一次页面并存入 raw_snapshots 表。
+    这是最基础的爬虫功能。
+    """
+    project = project or default_project()
+    scraped_at = datetime.now(timezone.utc)
+    metrics = fetch_metrics(project, scraped_at)
+    store_snapshot(project, metrics, scraped_at)
+    return metrics
+
+
+def _baseline_utc(now_utc: datetime):
+    """返回 (本地今日日期, 昨天本地 23:00 对应的 UTC 时间)。"""
     now_local = now_utc.astimezone(tz_local)
     today_local_date = now_local.date()
-    
+
     yesterday_local_date = today_local_date - timedelta(days=1)
     baseline_local_dt = tz_local.localize(datetime.combine(yesterday_local_date, time(23, 0, 0)))
-    baseline_utc = baseline_local_dt.astimezone(timezone.utc)
-
-    baseline_snapshot = get_last_snapshot_before(baseline_utc)
-    latest_snapshot = get_last_snapshot_before(now_utc)
+    return today_local_date, baseline_local_dt.astimezone(timezone.utc)
 
-    if not baseline_snapshot or not latest_snapshot:
-        return None
 
+def _build_today_metrics(
+    baseline_snapshot: SnapshotRow,
+    latest_snapshot: SnapshotRow,
+    target: DailyTarget | None,
+) -> TodayMetrics:
     actual_daily_amt = latest_snapshot.total_amount - baseline_snapshot.total_amount
     actual_daily_qty = latest_snapshot.total_quantity - baseline_snapshot.total_quantity
     actual_total_amt = latest_snapshot.total_amount
     actual_total_qty = latest_snapshot.total_quantity
 
-    # 2. 读取目标
-    target = get_target_for_date(today_local_date)
-    
     # 默认目标为0，防止报错
     g_d_amt = target.goal_daily_amount if target else 0
     g_d_qty = target.goal_daily_quantity if target else 0
     g_t_amt = target.goal_total_amount if target else 0
     g_t_qty = target.goal_total_quantity if target else 0
 
-    # 3. 计算GAP (Gap = 目标 - 实际，如果是正数说明还差多少，负数说明超额)
+    # 计算GAP (Gap = 目标 - 实际，如果是正数说明还差多少，负数说明超额)
     gap_d_amt = g_d_amt - actual_daily_amt
     gap_d_qty = g_d_qty - actual_daily_qty
     gap_t_amt = g_t_amt - actual_total_amt
     gap_t_qty = g_t_qty - actual_total_qty
 
-    # 4. 计算百分比
+    # 计算百分比
     def calc_pct(actual, goal):
         return (actual / goal * 100) if goal > 0 else 0.0
 
-    metrics = TodayMetrics(
-        now_at=latest_snapshot.scraped_at.astimezone(tz_local),
+    return TodayMetrics(
+        now_at=latest_snapshot.observed_at.astimezone(tz_local),
         sales_amount_today=actual_daily_amt,
         sales_quantity_today=actual_daily_qty,
         total_amount=actual_total_amt,
@@ -116,21 +246,56 @@ def finalize_today_metrics(now_utc: datetime | None = None) -> TodayMetrics | No
         pct_total_quantity=calc_pct(actual_total_qty, g_t_qty),
     )
 
-    # 5. 存入数据库
-    upsert_daily_metrics(
+
+def compute_today_metrics(now_utc: datetime | None = None) -> TodayMetrics | None:
+    """
+    只读地计算今日数据并对比目标，不写 daily_metrics（供战报查询使用）。
+    daily_metrics 的落库由 scraper.jobs 中的定时任务通过 finalize_today_metrics 完成。
+    """
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+
+    today_local_date, baseline_utc = _baseline_utc(now_utc)
+    baseline_snapshot, latest_snapshot = get_boundary_snapshots(baseline_utc, now_utc)
+    if not baseline_snapshot or not latest_snapshot:
+        return None
+
+    return _build_today_metrics(baseline_snapshot, latest_snapshot, get_target_for_date(today_local_date))
+
+
+def finalize_today_metrics(now_utc: datetime | None = None) -> TodayMetrics | None:
+    """
+    计算今日数据，对比目标，并更新 daily_metrics 表。
+    取基准/最新快照和写入 daily_metrics 在同一条 SQL 里完成，只需一次数据库往返。
+    """
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+
+    # 1. 基准时间与目标（目标来自 CSV，可以在查库之前确定）
+    today_local_date, baseline_utc = _baseline_utc(now_utc)
+    target = get_target_for_date(today_local_date)
+
+    # 2. 取快照并写入数据库
+    baseline_snapshot, latest_snapshot = finalize_daily_metrics(
         date=today_local_date,
-        baseline_amount=baseline_snapshot.total_amount,
-        baseline_quantity=baseline_snapshot.total_quantity,
-        end_amount=latest_snapshot.total_amount,
-        end_quantity=latest_snapshot.total_quantity,
-        goal_daily_amount=g_d_amt,
-        goal_daily_quantity=g_d_qty,
-        goal_total_amount=g_t_amt,
-        goal_total_quantity=g_t_qty,
-        diff_daily_amount=gap_d_amt,
-        diff_daily_quantity=gap_d_qty,
-        diff_total_amount=gap_t_amt,
-        diff_total_quantity=gap_t_qty,
+        baseline_at=baseline_utc,
+        latest_at=now_utc,
+        goal_daily_amount=target.goal_daily_amount if target else 0,
+        goal_daily_quantity=target.goal_daily_quantity if target else 0,
+        goal_total_amount=target.goal_total_amount if target else 0,
+        goal_total_quantity=target.goal_total_quantity if target else 0,
     )
 
-    return metrics
+    if not baseline_snapshot or not latest_snapshot:
+        return None
+
+    return _build_today_metrics(baseline_snapshot, latest_snapshot, target)
+
+
+def recompute_daily_range(start: date, end: date, project: str | None = None) -> list[date]:
+    """
+    补算或重算 [start, end]（本地日期，闭区间）的 daily_metrics，例如定时任务漏跑或 targets.csv 修改之后。
+    所有日期在一条 SQL 里完成，返回实际写入的日期（缺少快照的日子会被跳过）。
+    """
+    targets = get_targets_between(start, end, project)
+    return recompute_daily_metrics(start, end, targets=targets, project=project)
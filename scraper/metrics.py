@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ContextDecorator
+from dataclasses import dataclass, field
+from typing import Mapping, Optional
+
+# 秒；覆盖从单次数据库查询（毫秒级）到一次完整抓取（十几秒）的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass
+class StageStats:
+    count: int = 0
+    errors: int = 0
+    total: float = 0.0  # 累计耗时（秒）
+    max: float = 0.0
+    buckets: list[int] = field(default_factory=list)  # 每个桶（不累加）的次数，最后一个为 +Inf
+
+
+class StageMetrics:
+    """
+    按阶段（fetch / parse / db.xxx / report / reply ...）统计调用次数、错误次数和耗时直方图。
+    进程内累加，/metrics 以 Prometheus 文本格式输出，定时任务结束时输出一行摘要。
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.bucket_bounds = buckets
+        self._lock = threading.Lock()
+        self._stages: dict[str, StageStats] = {}
+
+    def observe(self, stage: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats(buckets=[0] * (len(self.bucket_bounds) + 1))
+            stats.count += 1
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            stats.buckets[bisect_left(self.bucket_bounds, seconds)] += 1
+            if error:
+                stats.errors += 1
+
+    def snapshot(self) -> dict[str, StageStats]:
+        with self._lock:
+            return {
+                stage: StageStats(s.count, s.errors, s.total, s.max, list(s.buckets))
+                for stage, s in self._stages.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+
+    def summary(self, since: Optional[Mapping[str, StageStats]] = None) -> str:
+        """
+        一行文本摘要：每个阶段的次数、平均/累计耗时和错误数。
+        传入之前的 snapshot() 时只统计这之后的增量（max 无法做差，摘要里不输出）。
+        """
+        parts = []
+        for stage, stats in sorted(self.snapshot().items()):
+            before = since.get(stage) if since else None
+            count = stats.count - (before.count if before else 0)
+            if count <= 0:
+                continue
+            total = stats.total - (before.total if before else 0.0)
+            errors = stats.errors - (before.errors if before else 0)
+            part = f"{stage} n={count} avg={total / count * 1000:.1f}ms total={total * 1000:.0f}ms"
+            if errors:
+                part += f" errors={errors}"
+            parts.append(part)
+        return "; ".join(parts) if parts else "no instrumented calls"
+
+    def render_prometheus(
+        self,
+        gauges: Optional[Mapping[str, float]] = None,
+        counters: Optional[Mapping[str, float]] = None,
+    ) -> str:
+        """
+        Prometheus 文本格式（0.0.4）。gauges / counters 为额外输出的瞬时值和只增计数，键为完整的指标名
+        （计数按惯例以 _total 结尾，这样才能用 rate()）。
+        """
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP scraper_stage_duration_seconds Time spent per instrumented stage.",
+            "# TYPE scraper_stage_duration_seconds histogram",
+        ]
+        for stage, stats in sorted(snapshot.items()):
+            label = f'stage="{stage}"'
+            cumulative = 0
+            for bound, hits in zip(self.bucket_bounds, stats.buckets):
+                cumulative += hits
+                lines.append(f'scraper_stage_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'scraper_stage_duration_seconds_bucket{{{label},le="+Inf"}} {stats.count}')
+            lines.append(f"scraper_stage_duration_seconds_sum{{{label}}} {stats.total:.6f}")
+            lines.append(f"scraper_stage_duration_seconds_count{{{label}}} {stats.count}")
+        lines.append("# HELP scraper_stage_errors_total Instrumented calls that raised.")
+        lines.append("# TYPE scraper_stage_errors_total counter")
+        for stage, stats in sorted(snapshot.items()):
+            lines.append(f'scraper_stage_errors_total{{stage="{stage}"}} {stats.errors}')
+        for name, value in (counters or {}).items():
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# 进程级共享实例
+stage_metrics = StageMetrics()
+
+
+class timed(ContextDecorator):
+    """
+    统计一段代码的耗时与是否抛错，既可以用作 with 语句，也可以用作函数装饰器：
+
+        @timed("parse")
+        def parse_metrics(...): ...
+
+        with timed("report"):
+            ...
+    """
+
+    def __init__(self, stage: str, metrics: StageMetrics | None = None) -> None:
+        self.stage = stage
+        self.metrics = metrics or stage_metrics
+        self._start = 0.0
+
+    def _recreate_cm(self):
+        # 用作装饰器时每次调用都新建实例，多线程并发调用互不干扰
+        return type(self)(self.stage, self.metrics)
+
+    def __enter__(self) -> "timed":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.metrics.observe(self.stage, time.perf_counter() - self._start, error=exc_type is not None)
+        return False
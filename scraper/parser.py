@@ -1,8 +1,13 @@
 from __future__ import annotations
 
+import re
 from dataclasses import dataclass
+from functools import lru_cache
+from html import unescape
 
-from lxml import html
+from lxml import etree, html
+
+from .metrics import timed
 
 
 @dataclass
@@ -17,23 +22,72 @@ class SnapshotMetrics:
 AMOUNT_XPATH = "/html/body/section/div[2]/div[3]/div[1]/dl/dd"
 QUANTITY_XPATH = "/html/body/section/div[2]/div[3]/div[3]/div[1]/dl/dd"
 
+AMOUNT_LABEL = "集まっている金額"
+QUANTITY_LABEL = "サポーター"
+
+_NON_DIGIT_RE = re.compile(r"\D+")
+_TAG_RE = re.compile(r"<[^>]*>")
+# 快速路径：直接在原始 HTML 上匹配 <dt>标签</dt><dd>数值</dd>，不构建 DOM
+_DT_DD_RE = re.compile(
+    r"<dt\b[^>]*>((?:(?!</dt>).)*)</dt>\s*<dd\b[^>]*>((?:(?!</dd>).)*)</dd>",
+    re.S | re.I,
+)
+
 
 def _parse_int_from_text(text: str) -> int:
     # 去掉日文单位、逗号、空格等，只保留数字
-    digits = "".join(ch for ch in text if ch.isdigit())
+    digits = _NON_DIGIT_RE.sub("", text)
     if not digits:
         raise ValueError(f"Cannot parse int from text: {text!r}")
     return int(digits)
 
 
-def parse_metrics(html_text: str) -> SnapshotMetrics:
+@lru_cache(maxsize=64)
+def _compiled_xpath(expr: str) -> etree.XPath:
+    return etree.XPath(expr)
+
+
+def _strip_tags(fragment: str) -> str:
+    return unescape(_TAG_RE.sub("", fragment)).strip()
+
+
+def parse_metrics_fast(html_text: str) -> SnapshotMetrics | None:
+    """
+    快速路径：用正则按标签文字定位 hero widget 里的 dt/dd 对。
+    只有两个标签都恰好出现一次时才返回结果，否则返回 None 交给完整 DOM 解析。
+    """
+    amount_texts: list[str] = []
+    quantity_texts: list[str] = []
+    for match in _DT_DD_RE.finditer(html_text):
+        label = _strip_tags(match.group(1))
+        if AMOUNT_LABEL in label:
+            amount_texts.append(match.group(2))
+        elif QUANTITY_LABEL in label:
+            quantity_texts.append(match.group(2))
+
+    if len(amount_texts) != 1 or len(quantity_texts) != 1:
+        return None
+    try:
+        return SnapshotMetrics(
+            total_amount=_parse_int_from_text(_strip_tags(amount_texts[0])),
+            total_quantity=_parse_int_from_text(_strip_tags(quantity_texts[0])),
+        )
+    except ValueError:
+        return None
+
+
+def parse_metrics_full(
+    html_text: str,
+    amount_xpath: str = AMOUNT_XPATH,
+    quantity_xpath: str = QUANTITY_XPATH,
+) -> SnapshotMetrics:
     """
-    根据固定 XPath 解析出累计销售额与累计销量。
+    完整路径：构建 lxml DOM，按（预编译的）XPath 解析。
     """
     tree = html.fromstring(html_text)
 
-    amount_nodes = tree.xpath(AMOUNT_XPATH)
-    quantity_nodes = tree.xpath(QUANTITY_XPATH)
+    amount_nodes = _compiled_xpath(amount_xpath)(tree)
+    quantity_nodes = _compiled_xpath(quantity_xpath)(tree)
 
     if not amount_nodes or not quantity_nodes:
         raise ValueError("XPath did not match expected nodes for amount/quantity.")
@@ -46,3 +100,20 @@ def parse_metrics(html_text: str) -> SnapshotMetrics:
 
     return SnapshotMetrics(total_amount=total_amount, total_quantity=total_quantity)
 
+
+@timed("parse")
+def parse_metrics(
+    html_text: str,
+    amount_xpath: str = AMOUNT_XPATH,
+    quantity_xpath: str = QUANTITY_XPATH,
+    fast: bool = True,
+) -> SnapshotMetrics:
+    """
+    根据 XPath 解析出累计销售额与累计销量（默认使用 hero widget 的固定 XPath）。
+    使用默认 XPath 时先尝试不建 DOM 的快速路径，匹配不上再回退到完整解析。
+    """
+    if fast and amount_xpath == AMOUNT_XPATH and quantity_xpath == QUANTITY_XPATH:
+        metrics = parse_metrics_fast(html_text)
+        if metrics is not None:
+            return metrics
+    return parse_metrics_full(html_text, amount_xpath, quantity_xpath)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import ContextDecorator
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# cProfile 同一时刻只能有一个在运行，tracemalloc 也是进程级的：同时只采集一个会话，其余直接跳过
+_session_lock = threading.Lock()
+
+
+def _should_sample(rate: float) -> bool:
+    return rate >= 1.0 or (rate > 0 and random.random() < rate)
+
+
+def _rotate(directory: Path, keep: int) -> None:
+    """只保留最新的 keep 次会话（每次会话一个 .pstats 和一个同名 .txt）。"""
+    if keep <= 0:
+        return
+    sessions = sorted(directory.glob("*.pstats"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in sessions[keep:]:
+        for path in (old, old.with_suffix(".txt")):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class profiled(ContextDecorator):
+    """
+    按 PROFILE_RATE 的概率对一段代码做 cProfile + tracemalloc 采样，结果写到 PROFILE_DIR：
+    <时间（微秒）>-<名称>-<pid>.pstats（可用 snakeviz / pstats 打开）和同名 .txt（耗时 Top 函数、内存分配 Top 行、峰值内存）。
+    cProfile 只记录调用线程，线程池里的工作线程不在其中；tracemalloc 统计整个进程的分配。
+    rate 为 None 时每次进入都读取 settings.profile_rate，因此可以在运行时调整。
+    """
+
+    def __init__(self, name: str, rate: Optional[float] = None) -> None:
+        self.name = name
+        self.rate = rate
+        self._profiler: Optional[cProfile.Profile] = None
+        self._started_tracemalloc = False
+        self._start = 0.0
+
+    def _recreate_cm(self):
+        return type(self)(self.name, self.rate)
+
+    def __enter__(self) -> "profiled":
+        rate = settings.profile_rate if self.rate is None else self.rate
+        if not _should_sample(rate) or not _session_lock.acquire(blocking=False):
+            return self
+        try:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(settings.profile_traceback_frames)
+                self._started_tracemalloc = True
+            tracemalloc.reset_peak()
+            self._profiler = cProfile.Profile()
+            self._start = time.perf_counter()
+            self._profiler.enable()
+        except Exception:
+            self._cleanup()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if self._profiler is None:
+            return False
+        self._profiler.disable()
+        elapsed = time.perf_counter() - self._start
+        try:
+            self._write(elapsed, failed=exc_type is not None)
+        except Exception as write_exc:  # noqa: BLE001 - 写结果失败不能影响被采样的任务
+            logger.warning("Failed to write profile for %s: %s", self.name, write_exc)
+        finally:
+            self._cleanup()
+        return False
+
+    def _cleanup(self) -> None:
+        self._profiler = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        _session_lock.release()
+
+    def _write(self, elapsed: float, failed: bool) -> None:
+        directory = Path(settings.profile_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        # 精确到微秒，同一秒内的多次采样不会互相覆盖
+        stem = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{self.name}-{os.getpid()}"
+        pstats_path = directory / f"{stem}.pstats"
+        # 先取内存快照，避免把下面导出 pstats 时的分配也算进去
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            )
+        )
+        self._profiler.dump_stats(pstats_path)
+        out = io.StringIO()
+        out.write(f"{self.name}: {elapsed:.3f}s{' (failed)' if failed else ''}, pid {os.getpid()}\n")
+        out.write(f"traced memory: current={current / 1024:.1f} KiB peak={peak / 1024:.1f} KiB\n\n")
+        stats = pstats.Stats(self._profiler, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(settings.profile_top)
+        out.write(f"\nTop {settings.profile_top} allocations (by line):\n")
+        for stat in snapshot.statistics("lineno")[: settings.profile_top]:
+            out.write(f"{stat}\n")
+        pstats_path.with_suffix(".txt").write_text(out.getvalue(), encoding="utf-8")
+
+        _rotate(directory, settings.profile_keep)
+        logger.info("Profile for %s (%.2fs) written to %s", self.name, elapsed, pstats_path)
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional
+
+import numpy as np
+
+from .config import settings
+from .db import SnapshotRow, get_latest_snapshots, get_snapshots_asof
+from .logic import tz_local
+from .projects import load_projects
+from .series import SnapshotSeries
+from .targets import DailyTarget, get_final_target, get_target_for_date
+
+
+# 把各项目的时间轴错开拼成一条有序数组，一次 searchsorted 就能同时查所有项目（约 317 年，远大于数据跨度）
+_SEGMENT_SPAN = 1e10
+
+
+@dataclass(frozen=True)
+class Projection:
+    project: str
+    as_of: datetime  # 最新快照的观测时间（本地时区）
+    sold_today_quantity: int
+    sold_today_amount: int
+    pace_quantity_per_hour: float  # 预测当日用的速度（最近 projection_window 内，数据不足时取当日平均）
+    pace_amount_per_hour: float
+    projected_day_quantity: int  # 按当前速度，到今天 23:00 的当日新增
+    projected_day_amount: int
+    goal_daily_quantity: int
+    goal_daily_amount: int
+    campaign_end: Optional[date]  # targets.csv 中该项目最后一个日期
+    projected_total_quantity: int  # 按最近 projection_campaign_window 的速度，到众筹结束时的累计
+    projected_total_amount: int
+    goal_total_quantity: int
+    goal_total_amount: int
+
+
+def _local_boundary(d: date) -> float:
+    return tz_local.localize(datetime.combine(d, time(23, 0))).timestamp()
+
+
+def _rate(delta: np.ndarray, seconds: np.ndarray) -> np.ndarray:
+    return np.divide(delta, seconds, out=np.zeros(len(delta)), where=seconds > 0)
+
+
+def project_series(
+    series: dict[str, SnapshotSeries],
+    latest: dict[str, SnapshotRow],
+    daily_targets: dict[str, Optional[DailyTarget]],
+    final_targets: dict[str, Optional[DailyTarget]],
+) -> dict[str, Projection]:
+    """
+    对多个项目一次性做向量化预测。每个项目的「当前」是它最新快照的观测时间，
+    当日以本地 23:00 为界（与战报一致）。series 可以是完整历史，也可以只包含各查找时刻之前的最后一条快照。
+    """
+    names = [name for name in latest if name in series and len(series[name])]
+    if not names:
+        return {}
+    n = len(names)
+    offsets = np.arange(n) * _SEGMENT_SPAN
+    lengths = np.array([len(series[name]) for name in names])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    ts_all = np.concatenate([series[name].ts + offsets[i] for i, name in enumerate(names)])
+    amount_all = np.concatenate([series[name].amount for name in names])
+    quantity_all = np.concatenate([series[name].quantity for name in names])
+
+    def asof(when: np.ndarray):
+        idx = np.searchsorted(ts_all, when + offsets, side="right") - 1
+        found = idx >= starts
+        idx = np.where(found, idx, starts)
+        return amount_all[idx].astype("f8"), quantity_all[idx].astype("f8"), ts_all[idx] - offsets, found
+
+    as_of = np.array([latest[name].observed_at.timestamp() for name in names])
+    cur_amount = np.array([latest[name].total_amount for name in names], dtype="f8")
+    cur_quantity = np.array([latest[name].total_quantity for name in names], dtype="f8")
+    local_dates = [latest[name].observed_at.astimezone(tz_local).date() for name in names]
+    day_start = np.array([_local_boundary(d - timedelta(days=1)) for d in local_dates])
+    day_end = np.array([_local_boundary(d) for d in local_dates])
+    campaign_end = [final_targets.get(name).date if final_targets.get(name) else None for name in names]
+    campaign_end_ts = np.array([_local_boundary(d) if d else np.nan for d in campaign_end])
+
+    # 当日基准与当日平均速度
+    base_amount, base_quantity, _, has_base = asof(day_start)
+    sold_amount = np.where(has_base, cur_amount - base_amount, 0.0)
+    sold_quantity = np.where(has_base, cur_quantity - base_quantity, 0.0)
+    elapsed = np.where(has_base, as_of - day_start, 0.0)
+    day_amount_rate = _rate(sold_amount, elapsed)
+    day_quantity_rate = _rate(sold_quantity, elapsed)
+
+    # 最近窗口内的速度，窗口起点之前没有快照时退回当日平均。
+    # 去重写入时覆盖窗口起点的那条快照可能早在窗口之前就开始了，但它的数值就是窗口起点的数值，
+    # 所以除以窗口长度，而不是距它 scraped_at 的时间
+    r_amount, r_quantity, r_ts, has_recent = asof(as_of - settings.projection_window)
+    span = np.where(has_recent, np.minimum(as_of - r_ts, settings.projection_window), 0.0)
+    amount_rate = np.where(span > 0, _rate(cur_amount - r_amount, span), day_amount_rate)
+    quantity_rate = np.where(span > 0, _rate(cur_quantity - r_quantity, span), day_quantity_rate)
+
+    remaining_day = np.maximum(day_end - as_of, 0.0)
+    projected_day_amount = sold_amount + amount_rate * remaining_day
+    projected_day_quantity = sold_quantity + quantity_rate * remaining_day
+
+    # 众筹结束时的累计：用更长窗口的速度外推
+    c_amount, c_quantity, c_ts, has_campaign = asof(as_of - settings.projection_campaign_window)
+    c_span = np.where(has_campaign, np.minimum(as_of - c_ts, settings.projection_campaign_window), 0.0)
+    c_amount_rate = np.where(c_span > 0, _rate(cur_amount - c_amount, c_span), amount_rate)
+    c_quantity_rate = np.where(c_span > 0, _rate(cur_quantity - c_quantity, c_span), quantity_rate)
+    remaining_campaign = np.where(np.isnan(campaign_end_ts), 0.0, np.maximum(campaign_end_ts - as_of, 0.0))
+    projected_total_amount = cur_amount + c_amount_rate * remaining_campaign
+    projected_total_quantity = cur_quantity + c_quantity_rate * remaining_campaign
+
+    result: dict[str, Projection] = {}
+    for i, name in enumerate(names):
+        daily = daily_targets.get(name)
+        final = final_targets.get(name)
+        result[name] = Projection(
+            project=name,
+            as_of=latest[name].observed_at.astimezone(tz_local),
+            sold_today_quantity=int(sold_quantity[i]),
+            sold_today_amount=int(sold_amount[i]),
+            pace_quantity_per_hour=float(quantity_rate[i] * 3600),
+            pace_amount_per_hour=float(amount_rate[i] * 3600),
+            projected_day_quantity=int(round(projected_day_quantity[i])),
+            projected_day_amount=int(round(projected_day_amount[i])),
+            goal_daily_quantity=daily.goal_daily_quantity if daily else 0,
+            goal_daily_amount=daily.goal_daily_amount if daily else 0,
+            campaign_end=campaign_end[i],
+            projected_total_quantity=int(round(projected_total_quantity[i])),
+            projected_total_amount=int(round(projected_total_amount[i])),
+            goal_total_quantity=final.goal_total_quantity if final else 0,
+            goal_total_amount=final.goal_total_amount if final else 0,
+        )
+    return result
+
+
+def get_projections(projects: Optional[Iterable[str]] = None) -> dict[str, Projection]:
+    """
+    预测只用到每个项目 4 个时刻的快照：最新一条，以及当日基准（前一天 23:00）、最近 projection_window 起点、
+    最近 projection_campaign_window 起点各自之前的最后一条。一次查询按时刻取回（每个时刻一次索引探测），
+    不再读取整段历史，所以也不需要缓存；战报本身已按最新快照缓存。
+    """
+    slugs = list(projects) if projects is not None else [p.slug for p in load_projects()]
+    latest = get_latest_snapshots(slugs)
+    daily_targets, final_targets = {}, {}
+    lookups: list[tuple[str, datetime]] = []
+    for slug, row in latest.items():
+        as_of = row.observed_at
+        local_date = as_of.astimezone(tz_local).date()
+        daily_targets[slug] = get_target_for_date(local_date, slug)
+        final_targets[slug] = get_final_target(slug)
+        lookups.append((slug, tz_local.localize(datetime.combine(local_date - timedelta(days=1), time(23, 0)))))
+        lookups.append((slug, as_of - timedelta(seconds=settings.projection_window)))
+        lookups.append((slug, as_of - timedelta(seconds=settings.projection_campaign_window)))
+
+    rows: dict[str, dict[int, SnapshotRow]] = {slug: {row.id: row} for slug, row in latest.items()}
+    for (slug, _), row in zip(lookups, get_snapshots_asof(lookups)):
+        if row is not None:
+            rows[slug][row.id] = row
+    # 这几条快照上的 as-of 查找与在完整历史上查找结果相同
+    series = {
+        slug: SnapshotSeries.from_rows(sorted(by_id.values(), key=lambda r: r.scraped_at), slug)
+        for slug, by_id in rows.items()
+    }
+    return project_series(series, latest, daily_targets, final_targets)
+
+
+def get_projection(project: Optional[str] = None) -> Optional[Projection]:
+    project = project or settings.default_project
+    return get_projections([project]).get(project)
@@ -0,0 +1,58 @@
+import csv
+from dataclasses import dataclass
+from pathlib import Path
+
+from .config import settings
+from .parser import AMOUNT_XPATH, QUANTITY_XPATH
+
+# 与 targets.csv 一样放在项目根目录
+# 列：slug,url,amount_xpath,quantity_xpath（两个 XPath 留空则使用 hero widget 的默认值）
+PROJECTS_CSV_PATH = Path(__file__).resolve().parent.parent / "projects.csv"
+
+
+@dataclass(frozen=True)
+class Project:
+    slug: str
+    url: str
+    amount_xpath: str = AMOUNT_XPATH
+    quantity_xpath: str = QUANTITY_XPATH
+
+
+def default_project() -> Project:
+    return Project(slug=settings.default_project, url=settings.target_url)
+
+
+def load_projects() -> list[Project]:
+    """
+    读取项目注册表。没有 projects.csv 时只返回默认项目。
+    """
+    if not PROJECTS_CSV_PATH.exists():
+        return [default_project()]
+
+    projects: dict[str, Project] = {}
+    with open(PROJECTS_CSV_PATH, mode="r", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        for line_no, row in enumerate(reader, start=2):
+            slug = (row.get("slug") or "").strip()
+            url = (row.get("url") or "").strip()
+            if not slug or not url:
+                raise ValueError(f"{PROJECTS_CSV_PATH.name}:{line_no}: slug and url are required")
+            if slug in projects:
+                raise ValueError(f"{PROJECTS_CSV_PATH.name}:{line_no}: duplicate project slug {slug!r}")
+            projects[slug] = Project(
+                slug=slug,
+                url=url,
+                amount_xpath=(row.get("amount_xpath") or "").strip() or AMOUNT_XPATH,
+                quantity_xpath=(row.get("quantity_xpath") or "").strip() or QUANTITY_XPATH,
+            )
+    return list(projects.values()) or [default_project()]
+
+
+def get_project(slug: str | None = None) -> Project:
+    slug = slug or settings.default_project
+    for project in load_projects():
+        if project.slug == slug:
+            return project
+    if slug == settings.default_project:
+        return default_project()
+    raise KeyError(f"Unknown project: {slug}")
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from .archive import ArchivedPage, get_archive, read_blob
+from .db import SnapshotInput, rebuild_hourly_rollup, upsert_snapshots
+from .parser import AMOUNT_XPATH, QUANTITY_XPATH, parse_metrics
+from .projects import load_projects
+
+
+logger = logging.getLogger(__name__)
+
+# 解析结果缓存的上限（按页面内容去重，304 链接到同一页面的抓取只解析一次）
+_MAX_CACHED_RESULTS = 100_000
+
+
+@dataclass
+class ReparseStats:
+    pages: int = 0  # 归档中的抓取记录数
+    parsed: int = 0  # 实际解析的不同页面数
+    failed: int = 0  # 解析失败的抓取记录数
+    updated: int = 0
+    inserted: int = 0
+    seconds: float = 0.0
+
+    @property
+    def pages_per_sec(self) -> float:
+        return self.pages / self.seconds if self.seconds > 0 else 0.0
+
+
+def _parse_blob(task: tuple[str, str, str, str]) -> tuple[int, int] | str:
+    """子进程中执行：读取并解析一个归档页面，失败时返回错误信息（异常不一定能被 pickle）。"""
+    path, codec, amount_xpath, quantity_xpath = task
+    try:
+        metrics = parse_metrics(read_blob(path, codec), amount_xpath, quantity_xpath)
+    except Exception as exc:  # noqa: BLE001
+        return f"{type(exc).__name__}: {exc}"
+    return metrics.total_amount, metrics.total_quantity
+
+
+def _batches(pages, size: int):
+    batch: list[ArchivedPage] = []
+    for page in pages:
+        batch.append(page)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def reparse_archive(
+    project: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    workers: Optional[int] = None,
+    batch_size: int = 2000,
+    dry_run: bool = False,
+) -> ReparseStats:
+    """
+    用当前的 parser（以及 projects.csv 中的 XPath）重新解析归档的 HTML，并按 (project, scraped_at=fetched_at)
+    幂等地改写 raw_snapshots：数值变了的行被修正，缺失的时间点被补上，重复执行不会产生新行。
+    解析在进程池中并行；每 batch_size 条抓取记录写一次数据库。
+    """
+    archive = get_archive()
+    if archive is None:
+        raise RuntimeError("ARCHIVE_DIR is not configured")
+    xpaths = {p.slug: (p.amount_xpath, p.quantity_xpath) for p in load_projects()}
+    workers = workers or os.cpu_count() or 1
+
+    stats = ReparseStats()
+    results: dict[tuple[str, str, str], tuple[int, int] | str] = {}
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for batch in _batches(archive.iter_pages(project, start, end), batch_size):
+            keys = [(page.sha256, *xpaths.get(page.project, (AMOUNT_XPATH, QUANTITY_XPATH))) for page in batch]
+            todo = list(dict.fromkeys(key for key in keys if key not in results))
+            if len(results) + len(todo) > _MAX_CACHED_RESULTS:
+                results.clear()
+                todo = list(dict.fromkeys(keys))
+            tasks = []
+            for sha256, ax, qx in todo:
+                path, codec = archive.locate(sha256)
+                tasks.append((str(path), codec, ax, qx))
+            if pool is not None:
+                parsed = pool.map(_parse_blob, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+            else:
+                parsed = map(_parse_blob, tasks)
+            results.update(zip(todo, parsed))
+            stats.parsed += len(todo)
+
+            rows = []
+            for page, key in zip(batch, keys):
+                result = results[key]
+                if isinstance(result, str):
+                    stats.failed += 1
+                    logger.warning("Reparse failed for %s at %s: %s", page.project, page.fetched_at, result)
+                    continue
+                rows.append(SnapshotInput(page.project, page.fetched_at, *result))
+            stats.pages += len(batch)
+
+            if rows and not dry_run:
+                written = upsert_snapshots(rows)
+                stats.updated += written.updated
+                stats.inserted += written.inserted
+            elapsed = time.perf_counter() - started
+            logger.info("Reparsed %d pages (%.0f pages/s)", stats.pages, stats.pages / elapsed if elapsed else 0.0)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    # 小时汇总的增量刷新只看最近的数据，改写或补入历史行后要重算所在的小时桶
+    if stats.updated or stats.inserted:
+        rebuild_hourly_rollup(start, end, project)
+    stats.seconds = time.perf_counter() - started
+    return stats
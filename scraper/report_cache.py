@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Hashable
+
+from .config import settings
+
+
+@dataclass
+class _Flight:
+    event: threading.Event = field(default_factory=threading.Event)
+    value: str | None = None
+    error: BaseException | None = None
+
+
+class ReportCache:
+    """
+    战报文本的 TTL 缓存，键的第一个元素必须是项目 slug（便于按项目失效）。
+    同一个键的并发请求只会触发一次计算，其余请求等待并共享结果（single-flight）。
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 256) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: dict[Hashable, tuple[float, str]] = {}
+        self._inflight: dict[Hashable, _Flight] = {}
+        # 每个项目的失效代数：计算期间发生过失效，则结果不写回缓存
+        self._generation: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], str]) -> str:
+        project = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                generation = self._generation.get(project, 0)
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.error is None and self._generation.get(project, 0) == generation:
+                    self._store(key, flight.value)
+            flight.event.set()
+        return flight.value
+
+    def _store(self, key: tuple, value: str) -> None:
+        now = time.monotonic()
+        if len(self._entries) >= self.max_entries:
+            for stale in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[stale]
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (now + self.ttl, value)
+
+    def invalidate(self, project: str | None = None) -> None:
+        """丢弃某个项目（None 表示全部）的缓存，正在进行的计算结果也不会被缓存。"""
+        with self._lock:
+            if project is None:
+                projects = set(self._generation) | {key[0] for key in self._inflight}
+                self._entries.clear()
+            else:
+                projects = {project}
+                for key in [k for k in self._entries if k[0] == project]:
+                    del self._entries[key]
+            for name in projects:
+                self._generation[name] = self._generation.get(name, 0) + 1
+
+
+# 进程级共享实例：飞书 webhook 读取，scrape_once 写入新快照后失效
+report_cache = ReportCache(ttl=settings.report_cache_ttl)
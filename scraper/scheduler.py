@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import json
+import logging
+import random
+import threading
+import time as time_mod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Optional
+
+import pytz
+
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class HourlyTrigger:
+    """每小时第 minute 分触发。"""
+
+    def __init__(self, minute: int = 0) -> None:
+        self.minute = minute
+
+    def next_after(self, when: datetime) -> datetime:
+        candidate = when.replace(minute=self.minute, second=0, microsecond=0)
+        if candidate <= when:
+            candidate += timedelta(hours=1)
+        return candidate
+
+    def previous(self, when: datetime) -> Optional[datetime]:
+        return self.next_after(when - timedelta(hours=1))
+
+
+class DailyTrigger:
+    """每天本地时间 hour:minute 触发（按 settings.timezone）。"""
+
+    def __init__(self, hour: int, minute: int, tz_name: str | None = None) -> None:
+        self.at = time(hour, minute)
+        self.tz = pytz.timezone(tz_name or settings.timezone)
+
+    def next_after(self, when: datetime) -> datetime:
+        local_date = when.astimezone(self.tz).date()
+        while True:
+            candidate = self.tz.localize(datetime.combine(local_date, self.at)).astimezone(timezone.utc)
+            if candidate > when:
+                return candidate
+            local_date += timedelta(days=1)
+
+    def previous(self, when: datetime) -> Optional[datetime]:
+        return self.next_after(when - timedelta(days=1))
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[], object]
+    trigger: object  # 需要提供 next_after(datetime) / previous(datetime)
+    jitter: float = 0.0  # 每次触发随机推迟 0~jitter 秒，避免整点扎堆
+    # 运行状态
+    next_base: Optional[datetime] = None  # 下一次计划时间（未加抖动）
+    next_run_at: Optional[datetime] = None  # 实际触发时间（已加抖动）
+    running: bool = False
+    runs: int = 0
+    failures: int = 0
+    skipped_overlaps: int = 0
+    last_base: Optional[datetime] = None
+    last_duration: Optional[float] = None
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+
+class Scheduler:
+    """
+    进程内的常驻调度器：
+    - 触发时间加随机抖动
+    - 启动时若错过的上一次计划仍在 misfire_grace 秒内、且没有执行记录，立即补跑一次
+    - 同一个任务上一次还没结束时跳过本次（防止重叠）
+    - 记录每个任务的耗时
+    """
+
+    def __init__(
+        self,
+        jobs: list[Job],
+        misfire_grace: float = 1800,
+        state_file: str | None = None,
+        clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc),
+    ) -> None:
+        self.jobs = jobs
+        self.clock = clock  # 测试里可以换成假时钟
+        self.misfire_grace = misfire_grace
+        self.state_path = Path(state_file) if state_file else None
+        self._executor = ThreadPoolExecutor(max_workers=max(len(jobs), 1), thread_name_prefix="job")
+        self._stop = threading.Event()
+        self._state_lock = threading.Lock()
+
+    # --- 执行记录（用于重启后的补跑判断）---
+    def _load_state(self) -> dict[str, str]:
+        if self.state_path is None or not self.state_path.exists():
+            return {}
+        try:
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable scheduler state %s: %s", self.state_path, exc)
+            return {}
+
+    def _save_state(self) -> None:
+        if self.state_path is None:
+            return
+        state = {job.name: job.last_base.isoformat() for job in self.jobs if job.last_base}
+        with self._state_lock:
+            tmp = self.state_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(state), encoding="utf-8")
+            tmp.replace(self.state_path)
+
+    def _schedule_next(self, job: Job, after: datetime) -> None:
+        job.next_base = job.trigger.next_after(after)
+        job.next_run_at = job.next_base + timedelta(seconds=random.uniform(0, job.jitter))
+
+    def _run(self, job: Job, base: datetime) -> None:
+        start = time_mod.perf_counter()
+        logger.info("Job %s started (scheduled %s)", job.name, base.isoformat())
+        ok = False
+        try:
+            job.func()
+            ok = True
+        except Exception:  # noqa: BLE001 - 任务失败不影响调度器
+            logger.exception("Job %s failed", job.name)
+        finally:
+            # SystemExit / KeyboardInterrupt 之类的 BaseException 也要释放锁，否则这个任务之后永远被当作“仍在运行”
+            duration = time_mod.perf_counter() - start
+            job.last_duration = duration
+            job.runs += 1
+            if not ok:
+                job.failures += 1
+            job.last_base = base
+            job.running = False
+            job._lock.release()
+            self._save_state()
+            logger.info("Job %s %s in %.2fs", job.name, "finished" if ok else "FAILED", duration)
+
+    def _launch(self, job: Job, base: datetime) -> None:
+        if not job._lock.acquire(blocking=False):
+            job.skipped_overlaps += 1
+            logger.warning("Job %s is still running, skipping run scheduled at %s", job.name, base.isoformat())
+            return
+        job.running = True
+        self._executor.submit(self._run, job, base)
+
+    def start(self) -> None:
+        now = self.clock()
+        state = self._load_state()
+        for job in self.jobs:
+            previous = job.trigger.previous(now)
+            last = state.get(job.name)
+            if last:
+                job.last_base = datetime.fromisoformat(last)
+            missed = (
+                previous is not None
+                and (now - previous).total_seconds() <= self.misfire_grace
+                and (job.last_base is None or job.last_base < previous)
+            )
+            if missed:
+                logger.info("Job %s missed its run at %s, catching up now", job.name, previous.isoformat())
+                self._launch(job, previous)
+            self._schedule_next(job, now)
+            logger.info("Job %s next run at %s", job.name, job.next_run_at.isoformat())
+
+    def _run_due(self, now: datetime) -> None:
+        for job in self.jobs:
+            if job.next_run_at is not None and job.next_run_at <= now:
+                # 如果进程被挂起错过了多个时间点，只补跑一次
+                self._launch(job, job.next_base)
+                self._schedule_next(job, max(now, job.next_base))
+
+    def run_forever(self) -> None:
+        self.start()
+        try:
+            while not self._stop.is_set():
+                self._run_due(self.clock())
+                next_due = min(job.next_run_at for job in self.jobs)
+                wait = (next_due - self.clock()).total_seconds()
+                self._stop.wait(min(max(wait, 0.0), 60.0))
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import csv
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Iterable, Optional
+
+import numpy as np
+import pytz
+
+from .config import settings
+from .db import SnapshotRow, iter_query
+
+
+_ROW_DTYPE = np.dtype([("ts", "f8"), ("amount", "i8"), ("quantity", "i8")])
+_PROJECT_ROW_DTYPE = np.dtype([("project", "i4"), ("ts", "f8"), ("amount", "i8"), ("quantity", "i8")])
+
+
+def _epoch(when: datetime) -> float:
+    return when.timestamp()
+
+
+def day_boundaries(start: date, end: date, tz_name: str | None = None) -> np.ndarray:
+    """start-1 到 end 每天本地 23:00 对应的 UTC 秒数（共 (end-start).days + 2 个），夏令时由 pytz 处理。"""
+    return _day_boundaries(start, end, tz_name or settings.timezone)
+
+
+@lru_cache(maxsize=64)
+def _day_boundaries(start: date, end: date, tz_name: str) -> np.ndarray:
+    # 多个项目按同一日期范围计算时只算一次；返回只读数组，避免缓存被调用方改掉
+    tz = pytz.timezone(tz_name)
+    first = start - timedelta(days=1)
+    bounds = np.array(
+        [
+            tz.localize(datetime.combine(first + timedelta(days=i), time(23, 0))).timestamp()
+            for i in range((end - start).days + 2)
+        ],
+        dtype="f8",
+    )
+    bounds.flags.writeable = False
+    return bounds
+
+
+@dataclass
+class DailyDiffs:
+    days: np.ndarray  # datetime64[D]，本地日期
+    baseline_amount: np.ndarray
+    baseline_quantity: np.ndarray
+    end_amount: np.ndarray
+    end_quantity: np.ndarray
+    valid: np.ndarray  # bool：基准和结束快照都存在
+
+    @property
+    def amount(self) -> np.ndarray:
+        return self.end_amount - self.baseline_amount
+
+    @property
+    def quantity(self) -> np.ndarray:
+        return self.end_quantity - self.baseline_quantity
+
+
+class SnapshotSeries:
+    """
+    单个项目的快照时间序列，按列存成 NumPy 数组：
+    ts 为 UTC epoch 秒（float64），amount / quantity 为 int64，均按时间升序。
+    每行 24 字节，而一个 SnapshotRow 加上两个 datetime 要几百字节。
+    """
+
+    __slots__ = ("project", "ts", "amount", "quantity")
+
+    def __init__(self, project: str, ts: np.ndarray, amount: np.ndarray, quantity: np.ndarray) -> None:
+        self.project = project
+        self.ts = np.ascontiguousarray(ts, dtype="f8")
+        self.amount = np.ascontiguousarray(amount, dtype="i8")
+        self.quantity = np.ascontiguousarray(quantity, dtype="i8")
+
+    # --- 构造 ---
+    @classmethod
+    def from_rows(cls, rows: Iterable[SnapshotRow], project: str | None = None) -> "SnapshotSeries":
+        data = np.fromiter(
+            ((row.scraped_at.timestamp(), row.total_amount, row.total_quantity) for row in rows),
+            dtype=_ROW_DTYPE,
+        )
+        return cls._from_records(project or settings.default_project, data)
+
+    @classmethod
+    def from_csv(cls, path: str, project: str | None = None) -> "SnapshotSeries":
+        """读取 `scraper.cli export snapshots` 导出的 CSV（只取指定项目的行）。"""
+        project = project or settings.default_project
+        with open(path, newline="", encoding="utf-8") as f:
+            data = np.fromiter(
+                (
+                    (
+                        datetime.fromisoformat(row["scraped_at"]).timestamp(),
+                        int(row["total_amount"]),
+                        int(row["total_quantity"]),
+                    )
+                    for row in csv.DictReader(f)
+                    if row["project"] == project
+                ),
+                dtype=_ROW_DTYPE,
+            )
+        return cls._from_records(project, np.sort(data, order="ts"))
+
+    @classmethod
+    def load(cls, start: datetime, end: datetime, project: str | None = None) -> "SnapshotSeries":
+        """直接从数据库流式读取 [start, end) 的快照，不经过 SnapshotRow。"""
+        project = project or settings.default_project
+        rows = iter_query(
+            """
+            SELECT EXTRACT(EPOCH FROM scraped_at)::float8, total_amount, total_quantity
+            FROM raw_snapshots
+            WHERE project = %s AND scraped_at >= %s AND scraped_at < %s
+            ORDER BY scraped_at;
+            """,
+            (project, start, end),
+            itersize=50000,
+        )
+        return cls._from_records(project, np.fromiter(rows, dtype=_ROW_DTYPE))
+
+    @classmethod
+    def load_many(
+        cls,
+        start: datetime,
+        end: datetime,
+        projects: Optional[Iterable[str]] = None,
+    ) -> dict[str, "SnapshotSeries"]:
+        """一次查询读取多个项目（projects 为 None 时为全部项目），按项目拆分成各自的序列。"""
+        sql = """
+            SELECT project, EXTRACT(EPOCH FROM scraped_at)::float8, total_amount, total_quantity
+            FROM raw_snapshots
+            WHERE scraped_at >= %s AND scraped_at < %s
+        """
+        params: list = [start, end]
+        if projects is not None:
+            sql += " AND project = ANY(%s)"
+            params.append(list(projects))
+        sql += " ORDER BY project, scraped_at;"
+
+        codes: dict[str, int] = {}
+        rows = (
+            (codes.setdefault(project, len(codes)), ts, amount, quantity)
+            for project, ts, amount, quantity in iter_query(sql, params, itersize=50000)
+        )
+        data = np.fromiter(rows, dtype=_PROJECT_ROW_DTYPE)
+        names = list(codes)
+        result: dict[str, SnapshotSeries] = {}
+        # 结果按项目排序，每个项目是连续的一段
+        splits = np.flatnonzero(np.diff(data["project"])) + 1
+        for chunk in np.split(data, splits) if len(data) else []:
+            name = names[chunk["project"][0]]
+            result[name] = cls(name, chunk["ts"], chunk["amount"], chunk["quantity"])
+        return result
+
+    @classmethod
+    def _from_records(cls, project: str, data: np.ndarray) -> "SnapshotSeries":
+        return cls(project, data["ts"], data["amount"], data["quantity"])
+
+    # --- 基本信息 ---
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def __repr__(self) -> str:
+        return f"SnapshotSeries({self.project!r}, {len(self)} rows)"
+
+    @property
+    def nbytes(self) -> int:
+        return self.ts.nbytes + self.amount.nbytes + self.quantity.nbytes
+
+    # --- 向量化运算 ---
+    def asof_index(self, when: np.ndarray | float) -> np.ndarray:
+        """每个时刻之前（含）最后一条快照的下标，没有则为 -1。"""
+        return np.searchsorted(self.ts, when, side="right") - 1
+
+    def asof(self, when: np.ndarray | float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """返回 (amount, quantity, found)；found 为 False 的位置数值为 0。"""
+        idx = self.asof_index(when)
+        found = idx >= 0
+        safe = np.where(found, idx, 0)
+        if not len(self):
+            zeros = np.zeros(np.shape(idx), dtype="i8")
+            return zeros, zeros, found
+        return np.where(found, self.amount[safe], 0), np.where(found, self.quantity[safe], 0), found
+
+    def daily_diffs(
+        self,
+        start: date,
+        end: date,
+        now: Optional[datetime] = None,
+        tz_name: str | None = None,
+    ) -> DailyDiffs:
+        """
+        [start, end] 每个本地日期的基准（前一天 23:00 之前最后一条）与结束值（当天 23:00 或 now 之前最后一条），
+        与 recompute-daily / 战报的口径一致。基准时刻晚于 now 的日子 valid 为 False。
+        """
+        bounds = day_boundaries(start, end, tz_name)
+        now_ts = _epoch(now or datetime.now(timezone.utc))
+        capped = np.minimum(bounds, now_ts)
+        amount, quantity, found = self.asof(capped)
+        valid = found[:-1] & found[1:] & (bounds[:-1] < now_ts)
+        days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+        return DailyDiffs(
+            days=days,
+            baseline_amount=amount[:-1],
+            baseline_quantity=quantity[:-1],
+            end_amount=amount[1:],
+            end_quantity=quantity[1:],
+            valid=valid,
+        )
+
+    def resample(self, every: float, start: Optional[float] = None, end: Optional[float] = None) -> "SnapshotSeries":
+        """
+        在等间隔（every 秒）的时间网格上取每个格点之前最后一条快照的值（as-of 重采样）。
+        默认网格从第一条快照所在的整格开始，到最后一条快照为止；第一条快照之前的格点被丢弃。
+        """
+        if not len(self):
+            return SnapshotSeries(self.project, self.ts[:0], self.amount[:0], self.quantity[:0])
+        start = np.floor(self.ts[0] / every) * every if start is None else start
+        end = self.ts[-1] if end is None else end
+        grid = np.arange(start, end + every / 2, every)
+        amount, quantity, found = self.asof(grid)
+        return SnapshotSeries(self.project, grid[found], amount[found], quantity[found])
+
+    def velocity(self, window: float | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        每条快照处的销售速度 (ts, 金额/秒, 人数/秒)。
+        window 为 None 时用相邻两条快照计算；否则与 window 秒之前（as-of）的快照比较。
+        """
+        if len(self) < 2:
+            empty = np.empty(0)
+            return empty, empty, empty
+        if window is None:
+            dt = np.diff(self.ts)
+            return self.ts[1:], np.diff(self.amount) / dt, np.diff(self.quantity) / dt
+        prev = self.asof_index(self.ts - window)
+        ok = (prev >= 0) & (self.ts[np.maximum(prev, 0)] < self.ts)
+        prev = prev[ok]
+        ts = self.ts[ok]
+        dt = ts - self.ts[prev]
+        return (
+            ts,
+            (self.amount[ok] - self.amount[prev]) / dt,
+            (self.quantity[ok] - self.quantity[prev]) / dt,
+        )
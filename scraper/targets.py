@@ -1,8 +1,17 @@
 import csv
+import hashlib
+import io
+import logging
+import threading
+from bisect import bisect_left, bisect_right
 from datetime import date
 from dataclasses import dataclass
 from pathlib import Path
 
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
 # 自动定位项目根目录下的 targets.csv
 # parent是scraper文件夹，parent.parent是项目根目录
 TARGET_CSV_PATH = Path(__file__).resolve().parent.parent / "targets.csv"
@@ -14,24 +23,128 @@ class DailyTarget:
     goal_daily_quantity: int
     goal_total_amount: int
     goal_total_quantity: int
+    project: str = ""
+
 
-def get_target_for_date(d: date) -> DailyTarget | None:
-    if not TARGET_CSV_PATH.exists():
-        return None
+class TargetTable:
+    """
+    targets.csv 的内存索引：按 (project, date) 建字典，并为每个项目维护有序日期列表。
+    每次查询只做一次 stat，文件的 mtime/大小变化且内容哈希也变化时才重新解析。
+    CSV 可选 project 列，留空或没有该列的行归属默认项目。
+    """
 
-    with open(TARGET_CSV_PATH, mode="r", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._stat_key: tuple[int, int] | None = None
+        self._digest: str | None = None
+        # (按键索引, 每个项目的有序日期)；整体替换，保证读者拿到的是一致的快照
+        self._index: tuple[dict[tuple[str, date], DailyTarget], dict[str, list[date]]] = ({}, {})
+        self.errors: list[str] = []
+
+    def _parse(self, data: bytes) -> None:
+        by_key: dict[tuple[str, date], DailyTarget] = {}
+        errors: list[str] = []
+        reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+        for line_no, row in enumerate(reader, start=2):
+            # 只有逗号的空行直接跳过
+            if not any((value or "").strip() for key, value in row.items() if key):
+                continue
             try:
-                row_date = date.fromisoformat(row["date"].strip())
-                if row_date == d:
-                    return DailyTarget(
-                        date=row_date,
-                        goal_daily_amount=int(row["goal_daily_amount"]),
-                        goal_daily_quantity=int(row["goal_daily_quantity"]),
-                        goal_total_amount=int(row["goal_total_amount"]),
-                        goal_total_quantity=int(row["goal_total_quantity"]),
-                    )
-            except (ValueError, KeyError):
+                target = DailyTarget(
+                    date=date.fromisoformat(row["date"].strip()),
+                    goal_daily_amount=int(row["goal_daily_amount"]),
+                    goal_daily_quantity=int(row["goal_daily_quantity"]),
+                    goal_total_amount=int(row["goal_total_amount"]),
+                    goal_total_quantity=int(row["goal_total_quantity"]),
+                    project=(row.get("project") or "").strip() or settings.default_project,
+                )
+            except (ValueError, KeyError, TypeError, AttributeError) as exc:
+                errors.append(f"{self.path.name}:{line_no}: {exc}")
+                continue
+            key = (target.project, target.date)
+            if key in by_key:
+                errors.append(f"{self.path.name}:{line_no}: duplicate target for {key[0]} {key[1]}")
                 continue
-    return None
\ No newline at end of file
+            by_key[key] = target
+
+        dates: dict[str, list[date]] = {}
+        for project, d in by_key:
+            dates.setdefault(project, []).append(d)
+        for project_dates in dates.values():
+            project_dates.sort()
+
+        self._index = (by_key, dates)
+        self.errors = errors
+        for error in errors:
+            logger.warning("Invalid target row skipped: %s", error)
+        logger.info("Loaded %d targets from %s", len(by_key), self.path.name)
+
+    def refresh(self) -> None:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            with self._lock:
+                self._stat_key = None
+                self._digest = None
+                self._index = ({}, {})
+                self.errors = []
+            return
+
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if stat_key == self._stat_key:
+            return
+        with self._lock:
+            if stat_key == self._stat_key:
+                return
+            data = self.path.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+            # 只是被 touch 过、内容没变，就不必重新解析
+            if digest != self._digest:
+                self._parse(data)
+                self._digest = digest
+            self._stat_key = stat_key
+
+    def get(self, d: date, project: str | None = None) -> DailyTarget | None:
+        self.refresh()
+        by_key, _ = self._index
+        return by_key.get((project or settings.default_project, d))
+
+    def between(self, start: date, end: date, project: str | None = None) -> list[DailyTarget]:
+        """返回 [start, end] 闭区间内有目标的日期，按日期升序。"""
+        self.refresh()
+        project = project or settings.default_project
+        by_key, all_dates = self._index
+        dates = all_dates.get(project, [])
+        lo = bisect_left(dates, start)
+        hi = bisect_right(dates, end)
+        return [by_key[(project, d)] for d in dates[lo:hi]]
+
+    def last(self, project: str | None = None) -> DailyTarget | None:
+        """项目最后一个有目标的日期（即众筹结束日），其 goal_total_* 就是整个众筹的总目标。"""
+        self.refresh()
+        project = project or settings.default_project
+        by_key, all_dates = self._index
+        dates = all_dates.get(project)
+        return by_key[(project, dates[-1])] if dates else None
+
+
+_table = TargetTable(TARGET_CSV_PATH)
+
+
+def get_target_for_date(d: date, project: str | None = None) -> DailyTarget | None:
+    return _table.get(d, project)
+
+
+def get_targets_between(start: date, end: date, project: str | None = None) -> list[DailyTarget]:
+    return _table.between(start, end, project)
+
+
+def get_final_target(project: str | None = None) -> DailyTarget | None:
+    return _table.last(project)
+
+
+def get_target_load_errors() -> list[str]:
+    """最近一次加载 targets.csv 时被跳过的行及原因。"""
+    _table.refresh()
+    return list(_table.errors)
@@ -1,6 +1,7 @@
 import sys
 from datetime import datetime, timedelta, timezone
 # 确保能导入 scraper 模块
+from scraper.config import settings
 from scraper.db import get_conn
 
 def seed():
@@ -44,8 +45,8 @@ def seed():
 
     # --- 3. 执行 SQL 插入 ---
     sql = """
-    INSERT INTO raw_snapshots (scraped_at, total_amount, total_quantity)
-    VALUES (%s, %s, %s);
+    INSERT INTO raw_snapshots (project, scraped_at, total_amount, total_quantity)
+    VALUES (%s, %s, %s, %s);
     """
 
     try:
@@ -57,11 +58,11 @@ def seed():
                 print("🧹 已清空旧数据...")
 
                 # 2. 插入昨天的数据
-                cur.execute(sql, (yesterday_snapshot, BASE_AMOUNT, BASE_QUANTITY))
+                cur.execute(sql, (settings.default_project, yesterday_snapshot, BASE_AMOUNT, BASE_QUANTITY))
                 print(f"✅ 插入昨日基准 (UTC {yesterday_snapshot.strftime('%H:%M')}): 销量{BASE_QUANTITY}, 金额{BASE_AMOUNT}")
 
                 # 3. 插入今天的数据
-                cur.execute(sql, (today_snapshot, TARGET_AMOUNT, TARGET_QUANTITY))
+                cur.execute(sql, (settings.default_project, today_snapshot, TARGET_AMOUNT, TARGET_QUANTITY))
                 print(f"✅ 插入今日数据 (UTC {today_snapshot.strftime('%H:%M')}): 销量{TARGET_QUANTITY}, 金额{TARGET_AMOUNT}")
 
     except Exception as e:
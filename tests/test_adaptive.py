@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from scraper import adaptive
+from scraper.db import ProjectActivity
+
+NOW = datetime(2026, 2, 27, 12, 0, tzinfo=timezone.utc)
+WINDOW = 7200.0
+
+
+def _stub(monkeypatch, *activities):
+    calls = []
+
+    def fake(since):
+        calls.append(since)
+        return list(activities)
+
+    monkeypatch.setattr(adaptive, "get_recent_activity", fake)
+    return calls
+
+
+def test_single_changed_row_uses_baseline_and_full_window(monkeypatch):
+    # 去重写入：窗口内只有一条新行（刚卖出 2 个），变化前的那行在窗口之前开始
+    calls = _stub(
+        monkeypatch,
+        ProjectActivity(
+            project="p",
+            baseline_at=NOW - timedelta(hours=10),
+            first_at=NOW - timedelta(minutes=5),
+            last_at=NOW - timedelta(minutes=5),
+            quantity_delta=2,
+            amount_delta=20000,
+        ),
+    )
+
+    velocities = adaptive.estimate_velocity(NOW, WINDOW)
+
+    assert calls == [NOW - timedelta(seconds=WINDOW)]
+    assert velocities["p"] == pytest.approx(2 / WINDOW)
+
+
+def test_project_without_baseline_measured_from_first_row(monkeypatch):
+    _stub(
+        monkeypatch,
+        ProjectActivity(
+            project="new",
+            baseline_at=None,
+            first_at=NOW - timedelta(minutes=30),
+            last_at=NOW,
+            quantity_delta=3,
+            amount_delta=30000,
+        ),
+    )
+
+    assert adaptive.estimate_velocity(NOW, WINDOW)["new"] == pytest.approx(3 / 1800)
+
+
+def test_no_recent_rows_means_no_velocity(monkeypatch):
+    _stub(monkeypatch)
+
+    assert adaptive.estimate_velocity(NOW, WINDOW) == {}
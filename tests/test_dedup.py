@@ -0,0 +1,77 @@
+from scraper.dedup import MemoryDedupStore
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_seen_registers_then_reports_duplicate():
+    store = MemoryDedupStore(max_entries=10, ttl=60, clock=FakeClock())
+
+    assert store.seen("evt-1") is False
+    assert store.seen("evt-1") is True
+    assert store.seen("evt-2") is False
+
+
+def test_forget_allows_retry():
+    # 处理失败时 forget()，飞书重投的同一事件要能再处理一次
+    store = MemoryDedupStore(max_entries=10, ttl=60, clock=FakeClock())
+    store.seen("evt-1")
+
+    store.forget("evt-1")
+    store.forget("missing")
+
+    assert store.seen("evt-1") is False
+    assert store.seen("evt-1") is True
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    store = MemoryDedupStore(max_entries=10, ttl=60, clock=clock)
+    store.seen("evt-1")
+
+    clock.now += 59.9
+    assert store.seen("evt-1") is True
+    clock.now += 0.1
+    assert store.seen("evt-1") is False
+    # 过期后重新登记，TTL 从现在重新计算
+    clock.now += 59.9
+    assert store.seen("evt-1") is True
+
+
+def test_capacity_evicts_least_recently_written():
+    clock = FakeClock()
+    store = MemoryDedupStore(max_entries=2, ttl=60, clock=clock)
+    store.seen("a")
+    store.seen("b")
+    # 命中不算写入，不会把 a 挪到队尾
+    assert store.seen("a") is True
+
+    store.seen("c")
+
+    assert len(store._expires) == 2
+    assert store.seen("b") is True
+    assert store.seen("c") is True
+    assert store.seen("a") is False  # 被淘汰，重新登记（同时挤掉 b）
+    assert store.seen("b") is False
+
+
+def test_reregistered_expired_key_moves_to_newest():
+    clock = FakeClock()
+    store = MemoryDedupStore(max_entries=2, ttl=60, clock=clock)
+    store.seen("a")
+    clock.now += 30
+    store.seen("b")
+    clock.now += 31  # a 过期，b 仍有效
+    assert store.seen("a") is False
+
+    store.seen("c")
+
+    # 淘汰的是 b（最久未写入），而不是刚重新登记的 a
+    assert store.seen("a") is True
+    assert store.seen("c") is True
+    assert list(store._expires) == ["a", "c"]
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from scraper.db import SNAPSHOT_COLUMNS
+from scraper.export import export_rows
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def test_parquet_null_then_timestamp_last_seen_at(tmp_path):
+    # dedup 之前的历史快照 last_seen_at 为 NULL，之后的批次才有值：两批必须用同一个 schema 写入
+    t0 = datetime(2026, 2, 1, 14, 0, tzinfo=timezone.utc)
+    rows = [
+        (1, "iflytek_aiwtch", t0, 1000, 10, None),
+        (2, "iflytek_aiwtch", t0 + timedelta(hours=1), 2000, 20, t0 + timedelta(hours=2)),
+    ]
+    path = tmp_path / "snapshots.parquet"
+
+    stats = export_rows(rows, SNAPSHOT_COLUMNS, str(path), batch_rows=1)
+
+    assert stats.rows == 2
+    assert pq.ParquetFile(path).num_row_groups == 2
+    table = pq.read_table(path)
+    assert table.schema.field("last_seen_at").type == pa.timestamp("us", tz="UTC")
+    assert table.schema.field("total_amount").type == pa.int64()
+    assert table.column("last_seen_at").to_pylist() == [None, t0 + timedelta(hours=2)]
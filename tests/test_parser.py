@@ -0,0 +1,79 @@
+import pytest
+
+from bench_parser import SAMPLE_HTML
+from scraper.parser import SnapshotMetrics, parse_metrics, parse_metrics_fast, parse_metrics_full
+
+AMOUNT_DD = "<dd>170,006,897<span>円</span></dd>"
+QUANTITY_DIV = "<div><div><dl><dt><span>サポーター</span></dt><dd>4,830<span>人</span></dd></dl></div></div>"
+EXPECTED = SnapshotMetrics(total_amount=170006897, total_quantity=4830)
+
+
+def _variant(old: str, new: str) -> str:
+    assert old in SAMPLE_HTML
+    return SAMPLE_HTML.replace(old, new)
+
+
+def _full_or_none(page: str):
+    try:
+        return parse_metrics_full(page)
+    except ValueError:
+        return None
+
+
+# 版面小改动：两条路径都应该还能解析，而且结果一致
+SAME_LAYOUT = {
+    "sample": SAMPLE_HTML,
+    "whitespace": _variant(AMOUNT_DD, "<dd>\n   170,006,897\n   <span>円</span>\n </dd>").replace(
+        "</dt><dd>4,830", "</dt>\n\t <dd> 4,830 "
+    ),
+    "attributes": _variant(AMOUNT_DD, '<dd class="value" data-kind="amount">170,006,897<span>円</span></dd>')
+    .replace("<dt>集まっている金額</dt>", '<dt data-kind="amount" class="label">集まっている金額</dt>')
+    .replace("<dd>4,830", '<dd data-kind="count" class="value">4,830'),
+    "entities": _variant(AMOUNT_DD, "<dd>170&#44;006&#44;897<span>&#20870;</span></dd>"),
+}
+
+# 会让快速路径拿不准的页面：必须返回 None 交给完整解析，不能给出另一组数字
+AMBIGUOUS = {
+    # 标签在页面其他地方又出现一次（例如推荐项目卡片）
+    "duplicate_label": _variant(
+        '<div class="name"><p>project</p></div>',
+        '<div class="name"><p>project</p><dl><dt>集まっている金額</dt><dd>999円</dd></dl></div>',
+    ),
+    # dd 里没有数字
+    "no_digits": _variant(AMOUNT_DD, "<dd>非公開</dd>"),
+}
+
+
+@pytest.mark.parametrize("name", sorted(SAME_LAYOUT))
+def test_fast_and_full_agree(name):
+    page = SAME_LAYOUT[name]
+    assert parse_metrics_fast(page) == EXPECTED
+    assert parse_metrics_full(page) == EXPECTED
+    assert parse_metrics(page) == EXPECTED
+
+
+@pytest.mark.parametrize("name", sorted(AMBIGUOUS))
+def test_fast_path_falls_back_when_ambiguous(name):
+    page = AMBIGUOUS[name]
+    assert parse_metrics_fast(page) is None
+    full = _full_or_none(page)
+    if full is None:
+        with pytest.raises(ValueError):
+            parse_metrics(page)
+    else:
+        assert parse_metrics(page) == full
+
+
+def test_missing_node_raises_on_both_paths():
+    page = _variant(QUANTITY_DIV, "")
+    assert parse_metrics_fast(page) is None
+    with pytest.raises(ValueError):
+        parse_metrics_full(page)
+    with pytest.raises(ValueError):
+        parse_metrics(page)
+
+
+@pytest.mark.parametrize("page", [*SAME_LAYOUT.values(), *AMBIGUOUS.values()])
+def test_fast_path_never_disagrees_with_full(page):
+    fast = parse_metrics_fast(page)
+    assert fast is None or fast == _full_or_none(page)
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+from scraper.report_cache import ReportCache
+
+KEY = ("iflytek_aiwtch", "daily")
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+class _BlockingCompute:
+    """第一次调用阻塞到 release()，用来让其他线程在计算进行中排队。"""
+
+    def __init__(self, value="report"):
+        self.value = value
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5)
+        return self.value
+
+
+def _spawn(cache, key, compute, n):
+    results = [None] * n
+
+    def worker(i):
+        results[i] = cache.get_or_compute(key, compute)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def test_concurrent_callers_share_single_compute():
+    cache = ReportCache(ttl=60)
+    compute = _BlockingCompute()
+
+    threads, results = _spawn(cache, KEY, compute, 8)
+    assert compute.started.wait(5)
+    _wait_until(lambda: cache.coalesced == 7)
+    compute.release.set()
+    for t in threads:
+        t.join(5)
+
+    assert compute.calls == 1
+    assert results == ["report"] * 8
+    assert (cache.misses, cache.coalesced) == (1, 7)
+    # 结果已经写入缓存
+    assert cache.get_or_compute(KEY, lambda: pytest.fail("should be cached")) == "report"
+    assert cache.hits == 1
+
+
+def test_followers_receive_leader_error():
+    cache = ReportCache(ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+
+    def boom():
+        started.set()
+        assert release.wait(5)
+        raise RuntimeError("db down")
+
+    errors = []
+
+    def worker():
+        try:
+            cache.get_or_compute(KEY, boom)
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    assert started.wait(5)
+    _wait_until(lambda: cache.coalesced == 3)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(errors) == 4 and len({id(e) for e in errors}) == 1
+    # 失败的结果不缓存，下一次重新计算
+    assert cache.get_or_compute(KEY, lambda: "fresh") == "fresh"
+
+
+@pytest.mark.parametrize("project", ["iflytek_aiwtch", None])
+def test_invalidate_during_compute_discards_result(project):
+    cache = ReportCache(ttl=60)
+    compute = _BlockingCompute("stale")
+
+    threads, results = _spawn(cache, KEY, compute, 3)
+    assert compute.started.wait(5)
+    _wait_until(lambda: cache.coalesced == 2)
+    cache.invalidate(project)
+    compute.release.set()
+    for t in threads:
+        t.join(5)
+
+    # 已经在等的调用方拿到这次的结果，但它不会进缓存
+    assert results == ["stale"] * 3
+    assert cache.get_or_compute(KEY, lambda: "fresh") == "fresh"
+    assert cache.get_or_compute(KEY, lambda: pytest.fail("should be cached")) == "fresh"
+
+
+def test_invalidate_other_project_keeps_result():
+    cache = ReportCache(ttl=60)
+    compute = _BlockingCompute()
+
+    threads, _ = _spawn(cache, KEY, compute, 1)
+    assert compute.started.wait(5)
+    cache.invalidate("another_project")
+    compute.release.set()
+    for t in threads:
+        t.join(5)
+
+    assert cache.get_or_compute(KEY, lambda: pytest.fail("should be cached")) == "report"
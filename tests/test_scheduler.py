@@ -0,0 +1,120 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from scraper.scheduler import DailyTrigger, HourlyTrigger, Job, Scheduler
+
+
+class FakeClock:
+    def __init__(self, now: datetime) -> None:
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+def _drain(scheduler: Scheduler) -> None:
+    # 等线程池里已经提交的任务跑完
+    scheduler._executor.shutdown(wait=True)
+
+
+def _noop_job(name, trigger):
+    return Job(name, lambda: None, trigger)
+
+
+def test_hourly_misfire_within_grace_catches_up():
+    clock = FakeClock(datetime(2026, 3, 1, 10, 10, tzinfo=timezone.utc))
+    job = _noop_job("scrape", HourlyTrigger(0))
+    scheduler = Scheduler([job], misfire_grace=1800, clock=clock)
+
+    scheduler.start()
+    _drain(scheduler)
+
+    assert job.runs == 1
+    assert job.last_base == datetime(2026, 3, 1, 10, 0, tzinfo=timezone.utc)
+    assert job.next_base == datetime(2026, 3, 1, 11, 0, tzinfo=timezone.utc)
+
+
+def test_misfire_outside_grace_is_not_caught_up():
+    clock = FakeClock(datetime(2026, 3, 1, 10, 40, tzinfo=timezone.utc))
+    job = _noop_job("scrape", HourlyTrigger(0))
+    scheduler = Scheduler([job], misfire_grace=1800, clock=clock)
+
+    scheduler.start()
+    _drain(scheduler)
+
+    assert job.runs == 0
+
+
+def test_daily_misfire_skipped_when_state_shows_it_ran(tmp_path):
+    # 本地 23:00（Asia/Shanghai）= 15:00 UTC；重启在 23:05
+    clock = FakeClock(datetime(2026, 3, 1, 15, 5, tzinfo=timezone.utc))
+    ran_at = datetime(2026, 3, 1, 15, 0, tzinfo=timezone.utc)
+    state = tmp_path / "scheduler.json"
+
+    job = _noop_job("report", DailyTrigger(23, 0, "Asia/Shanghai"))
+    scheduler = Scheduler([job], misfire_grace=1800, state_file=str(state), clock=clock)
+    scheduler.start()
+    _drain(scheduler)
+    assert job.runs == 1
+    assert json.loads(state.read_text()) == {"report": ran_at.isoformat()}
+
+    # 再次重启：执行记录里已经有这一次，不重复补跑
+    job2 = _noop_job("report", DailyTrigger(23, 0, "Asia/Shanghai"))
+    scheduler2 = Scheduler([job2], misfire_grace=1800, state_file=str(state), clock=clock)
+    scheduler2.start()
+    _drain(scheduler2)
+    assert job2.runs == 0
+    assert job2.next_base == ran_at + timedelta(days=1)
+
+
+def test_overlapping_run_is_skipped():
+    clock = FakeClock(datetime(2026, 3, 1, 9, 59, tzinfo=timezone.utc))
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        assert release.wait(5)
+
+    job = Job("scrape", slow, HourlyTrigger(0))
+    scheduler = Scheduler([job], misfire_grace=0, clock=clock)
+    scheduler.start()
+    assert job.runs == 0
+
+    clock.now = datetime(2026, 3, 1, 10, 0, tzinfo=timezone.utc)
+    scheduler._run_due(clock.now)
+    assert started.wait(5)
+    assert job.running
+
+    # 上一次还没结束，11:00 这次跳过
+    clock.now = datetime(2026, 3, 1, 11, 0, tzinfo=timezone.utc)
+    scheduler._run_due(clock.now)
+    assert job.skipped_overlaps == 1
+    assert job.next_base == datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+    release.set()
+    _drain(scheduler)
+    assert (job.runs, job.failures, job.running) == (1, 0, False)
+    assert job.last_base == datetime(2026, 3, 1, 10, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("exc", [RuntimeError("boom"), SystemExit(1)])
+def test_failed_run_releases_job(exc):
+    clock = FakeClock(datetime(2026, 3, 1, 9, 59, tzinfo=timezone.utc))
+
+    def fail():
+        raise exc
+
+    job = Job("scrape", fail, HourlyTrigger(0))
+    scheduler = Scheduler([job], misfire_grace=0, clock=clock)
+    scheduler.start()
+    clock.now = datetime(2026, 3, 1, 10, 0, tzinfo=timezone.utc)
+    scheduler._run_due(clock.now)
+    _drain(scheduler)
+
+    assert (job.runs, job.failures, job.running) == (1, 1, False)
+    assert job.last_base == clock.now
+    assert job._lock.acquire(blocking=False)